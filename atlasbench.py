@@ -0,0 +1,359 @@
+# coding: utf8
+import sys, os, time, random, optparse, json, shutil, tempfile, multiprocessing
+from PIL import Image, ImageDraw
+from atlaslib.util import Size
+from atlaslib.atlas import Atlas, optimizedSize
+from atlaslib.atlaslayout import usedAtlasSize
+from atlaslib.atlasmanager import AtlasManager
+from atlaslib.atlaswriter import WRITERS
+from atlaslib.metrics import BuildMetrics, peakMemoryKB
+from atlaslib.fitindex import FittableImageIndex
+from atlaslib.packer import PACKERS, MAXRECTS_HEURISTICS, ImageGeometry
+
+class LinearImagePool(object):
+    '''Поиск подходящего изображения линейным просмотром списка (прежняя реализация AtlasManager).'''
+    def __init__(self, images, sortOn):
+        self.__images = list(images)
+
+    def __len__(self):
+        return len(self.__images)
+
+    def retainMostFittableImage(self, targetSize):
+        for image in reversed(self.__images):
+            if targetSize.canFit(image.sourceRect.size):
+                self.__images.remove(image)
+                return image
+        return None
+
+
+def syntheticImages(count, seed, padding=0):
+    '''Набор изображений случайных размеров: в основном мелкие иконки и немного крупных изображений.'''
+    rand = random.Random(seed)
+    images = []
+    for i in xrange(count):
+        if rand.random() < 0.9:
+            images.append(ImageGeometry(rand.randint(4, 64), rand.randint(4, 64), padding))
+        else:
+            images.append(ImageGeometry(rand.randint(64, 512), rand.randint(64, 512), padding))
+    return images
+
+
+def runFitQueries(pool, queries):
+    '''Выполнение последовательности запросов к набору изображений. Возвращает выбранные изображения и время.'''
+    start = time.time()
+    picks = [pool.retainMostFittableImage(query) for query in queries]
+    return picks, time.time() - start
+
+
+def benchmarkFitIndex(counts, sortOn, linearLimit, seed):
+    '''Сравнение времени поиска подходящего изображения индексом и линейным просмотром.'''
+    print 'fit index (sort on %s)' % sortOn
+    print '%10s %14s %14s %10s' % ('images', 'index, s', 'linear, s', 'speedup')
+    for count in counts:
+        images = syntheticImages(count, seed)
+        images.sort(key=lambda i: getattr(i.sourceRect.size, sortOn))
+        rand = random.Random(seed + 1)
+        queries = [Size(rand.randint(1, 512), rand.randint(1, 512)) for i in xrange(count)]
+
+        indexPicks, indexTime = runFitQueries(FittableImageIndex(images, sortOn), queries)
+        if count <= linearLimit:
+            linearPicks, linearTime = runFitQueries(LinearImagePool(images, sortOn), queries)
+            if linearPicks != indexPicks:
+                raise Exception('Index picks differ from linear scan for %d images' % count)
+            print '%10d %14.3f %14.3f %9.1fx' % (count, indexTime, linearTime, linearTime / max(indexTime, 1e-6))
+        else:
+            print '%10d %14.3f %14s %10s' % (count, indexTime, '-', '-')
+
+
+def packUsedAreas(packer, atlasSize):
+    '''
+    Размещение всех изображений заданным алгоритмом. Возвращает tuple (количество атласов, суммарная площадь
+    атласов после оптимизации размера, суммарная площадь областей атласов, занятых изображениями).
+    '''
+    atlasCount, texels, usedTexels = 0, 0, 0
+    while packer:
+        placements = packer.packAtlas()
+        if not placements:
+            raise Exception('Images do not fit in atlas %s' % atlasSize)
+        usedSize = usedAtlasSize(placements)
+        size = optimizedSize(atlasSize, usedSize)
+        atlasCount += 1
+        texels += size.width * size.height
+        usedTexels += usedSize.width * usedSize.height
+    return atlasCount, texels, usedTexels
+
+
+def benchmarkPackers(counts, atlasSize, padding, seed):
+    '''
+    Сравнение количества атласов и заполненности атласов разными алгоритмами размещения. Заполненность -
+    доля площади изображений в площади областей атласов, занятых изображениями (по границам размещенных
+    изображений), поэтому она различается и при одинаковых размерах атласов после оптимизации.
+    '''
+    print 'packers (atlas %s, padding %d)' % (atlasSize, padding)
+    print '%10s %-28s %8s %14s %14s %10s %10s' % ('images', 'packer', 'atlases', 'texels', 'used texels', 'occupancy',
+                                                  'time, s')
+    configurations = [('guillotine', sortOn, None, False) for sortOn in ('height', 'width')] + \
+                     [('maxrects', 'height', heuristic, False) for heuristic in MAXRECTS_HEURISTICS] + \
+                     [('multibin', 'height', heuristic, False) for heuristic in MAXRECTS_HEURISTICS] + \
+                     [('grid', 'height', None, False)] + \
+                     [(packerName, 'height', None, True) for packerName in ('guillotine', 'maxrects', 'multibin', 'grid')]
+    for count in counts:
+        images = syntheticImages(count, seed, padding)
+        imageArea = sum(image.sourceRect.size.width * image.sourceRect.size.height for image in images)
+        for packerName, sortOn, heuristic, allowRotation in configurations:
+            start = time.time()
+            packer = PACKERS[packerName](images, atlasSize, padding, sortOn, heuristic, allowRotation)
+            atlasCount, texels, usedTexels = packUsedAreas(packer, atlasSize)
+            name = '%s/%s%s' % (packerName, heuristic or sortOn, allowRotation and '+rotation' or '')
+            print '%10d %-28s %8d %14d %14d %9.1f%% %10.3f' % (count, name, atlasCount, texels, usedTexels,
+                                                               100.0 * imageArea / usedTexels, time.time() - start)
+
+
+def benchmarkPlacement(counts, atlasSize, padding, seed, repeat=3):
+    '''Среднее время размещения одного изображения разными алгоритмами размещения.'''
+    print 'placement cost (atlas %s, padding %d)' % (atlasSize, padding)
+    print '%10s %-28s %12s %14s' % ('images', 'packer', 'atlases', 'us/placement')
+    configurations = [('guillotine', 'height', None), ('guillotine', 'width', None), ('maxrects', 'height', None)]
+    for count in counts:
+        images = syntheticImages(count, seed, padding)
+        for packerName, sortOn, heuristic in configurations:
+            # Берем лучшее из нескольких измерений, чтобы уменьшить влияние посторонней нагрузки.
+            bestTime = None
+            for i in xrange(repeat):
+                start = time.time()
+                packer = PACKERS[packerName](images, atlasSize, padding, sortOn, heuristic)
+                atlasCount = 0
+                while packer:
+                    packer.packAtlas()
+                    atlasCount += 1
+                elapsed = time.time() - start
+                bestTime = bestTime is None and elapsed or min(bestTime, elapsed)
+            name = '%s/%s' % (packerName, heuristic or sortOn)
+            print '%10d %-28s %12d %14.2f' % (count, name, atlasCount, bestTime / count * 1e6)
+
+
+def drawSprite(rand, width, height, border=0, background=None):
+    '''Изображение со случайными фигурами внутри области, отстоящей от краев на border пикселей.'''
+    image = Image.new('RGBA', (width, height), background or (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    left, top, right, bottom = border, border, max(border, width - border - 1), max(border, height - border - 1)
+    color = lambda: (rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255), rand.randint(128, 255))
+    draw.rectangle((left, top, right, bottom), fill=color())
+    for i in xrange(rand.randint(1, 3)):
+        x0, x1 = sorted((rand.randint(left, right), rand.randint(left, right)))
+        y0, y1 = sorted((rand.randint(top, bottom), rand.randint(top, bottom)))
+        draw.ellipse((x0, y0, x1, y1), fill=color())
+    return image
+
+
+def iconsCorpus(rand, scale):
+    '''Много мелких иконок.'''
+    for i in xrange(int(2000 * scale)):
+        yield drawSprite(rand, rand.randint(8, 32), rand.randint(8, 32), rand.randint(0, 2))
+
+def mixedCorpus(rand, scale):
+    '''Изображения разных размеров: в основном мелкие и немного крупных.'''
+    for i in xrange(int(600 * scale)):
+        if rand.random() < 0.9:
+            yield drawSprite(rand, rand.randint(8, 64), rand.randint(8, 64))
+        else:
+            yield drawSprite(rand, rand.randint(64, 400), rand.randint(64, 400))
+
+def bordersCorpus(rand, scale):
+    '''Изображения с широкими прозрачными краями.'''
+    for i in xrange(int(400 * scale)):
+        size = rand.randint(64, 256)
+        yield drawSprite(rand, size, size, rand.randint(size / 4, size * 2 / 5))
+
+def duplicatesCorpus(rand, scale):
+    '''Изображения с большой долей дубликатов (в среднем 9 копий каждого).'''
+    sprites = [drawSprite(rand, rand.randint(16, 64), rand.randint(16, 64)) for i in xrange(int(100 * scale))]
+    for i in xrange(int(1000 * scale)):
+        yield rand.choice(sprites)
+
+def framesCorpus(rand, scale):
+    '''Кадры анимации одинакового размера без прозрачных краев.'''
+    for i in xrange(int(400 * scale)):
+        yield drawSprite(rand, 96, 96, background=(40, 40, 40, 255))
+
+# Синтетические наборы изображений для benchmark build.
+CORPORA = {
+    'icons': iconsCorpus,
+    'mixed': mixedCorpus,
+    'borders': bordersCorpus,
+    'duplicates': duplicatesCorpus,
+    'frames': framesCorpus,
+}
+
+def writeCorpus(directory, name, scale, seed):
+    '''
+    Запись набора изображений в каталог (набор детерминирован и создается повторно, только если его нет).
+    Возвращает путь к каталогу набора.
+    '''
+    corpusPath = os.path.join(directory, '%s-x%g-seed%d' % (name, scale, seed))
+    completeMark = os.path.join(corpusPath, '.complete')
+    if os.path.exists(completeMark):
+        return corpusPath
+    if os.path.exists(corpusPath):
+        shutil.rmtree(corpusPath)
+    os.makedirs(corpusPath)
+    for index, image in enumerate(CORPORA[name](random.Random(seed), scale)):
+        image.save(os.path.join(corpusPath, '%s%05d.png' % (name, index)))
+    open(completeMark, 'w').close()
+    return corpusPath
+
+
+def runBuild(args):
+    '''
+    Сборка атласов набора изображений с замером фаз. Выполняется в отдельном процессе, чтобы пиковый
+    расход памяти относился только к данному набору. Возвращает словарь с результатами.
+        decode, trim, dedup  время декодирования, обрезания краев и контрольных сумм при добавлении
+                             изображений (фазы decode, trim и checksum BuildMetrics);
+        ingest               добавление изображений в AtlasManager (все три шага вместе);
+        pack, composite, encode  размещение, компоновка и запись атласов.
+    '''
+    corpusPath, maxSize, padding, sortOn, alphaThreshold, writerName, outputPath = args
+    paths = sorted(os.path.join(corpusPath, fileName) for fileName in os.listdir(corpusPath) if fileName.endswith('.png'))
+    phases = {}
+
+    logFile = open(os.devnull, 'w')
+    start = time.time()
+    metrics = BuildMetrics()
+    manager = AtlasManager(corpusPath, maxSize.width, maxSize.height, 1 << 32, alphaThreshold, False, padding, logFile,
+                           lazyLoad=True, metrics=metrics)
+    manager.appendImages([(os.path.basename(path), path) for path in paths])
+    phases['ingest'] = time.time() - start
+
+    # Фазы добавления изображений берем до компоновки: при ней изображения декодируются повторно.
+    ingestReport = metrics.report()
+    for phase, metricsPhase in (('decode', 'decode'), ('trim', 'trim'), ('dedup', 'checksum')):
+        phases[phase] = ingestReport['phases'].get(metricsPhase, {'seconds': 0.0})['seconds']
+    uniqueImages = len(paths) - ingestReport['counters'].get('duplicates', 0)
+
+    start = time.time()
+    layouts = manager.planLayout(sortOn)
+    phases['pack'] = time.time() - start
+
+    phases['composite'] = phases['encode'] = 0.0
+    writer = WRITERS[writerName]()
+    outputBytes = 0
+    for index, layout in enumerate(layouts):
+        start = time.time()
+        atlas = Atlas(layout.atlasSize, logFile)
+        for image, position, rotated in layout.placements:
+            atlas.placeImage(image, position, rotated=rotated)
+        phases['composite'] += time.time() - start
+
+        start = time.time()
+        baseName = os.path.join(outputPath, 'atlas%d' % index)
+        writer.writeAtlas(baseName, atlas)
+        phases['encode'] += time.time() - start
+        outputBytes += sum(os.path.getsize(fileName) for fileName in writer.atlasFiles(baseName))
+
+    texels = sum(layout.texels for layout in layouts)
+    return {'images': len(paths), 'uniqueImages': uniqueImages, 'atlases': len(layouts), 'texels': texels,
+            'occupancy': float(sum(layout.usedArea for layout in layouts)) / texels, 'outputBytes': outputBytes,
+            'phases': phases, 'peakMemoryKB': peakMemoryKB()}
+
+
+def benchmarkBuild(corpora, scale, corpusDirectory, atlasSize, padding, sortOn, alphaThreshold, writerName, seed, jsonPath):
+    '''Полная сборка синтетических наборов изображений с замером фаз, памяти и плотности размещения.'''
+    phaseNames = ('decode', 'trim', 'dedup', 'ingest', 'pack', 'composite', 'encode')
+    print 'build (atlas %s, padding %d, scale %g)' % (atlasSize, padding, scale)
+    print '%-11s %7s %7s %7s %9s' % ('corpus', 'images', 'unique', 'atlases', 'occupancy') + \
+          ''.join(' %9s' % name for name in phaseNames) + ' %9s' % 'peak, MB'
+    results = {}
+    for name in corpora:
+        corpusPath = writeCorpus(corpusDirectory, name, scale, seed)
+        outputPath = tempfile.mkdtemp(prefix='atlasbench-')
+        try:
+            pool = multiprocessing.Pool(1)
+            try:
+                result = pool.apply(runBuild, ((corpusPath, atlasSize, padding, sortOn, alphaThreshold, writerName, outputPath),))
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            shutil.rmtree(outputPath)
+        results[name] = result
+        peakMemory = result['peakMemoryKB'] is not None and '%9.1f' % (result['peakMemoryKB'] / 1024.0) or '%9s' % '-'
+        print '%-11s %7d %7d %7d %8.1f%%' % (name, result['images'], result['uniqueImages'], result['atlases'],
+                                               result['occupancy'] * 100.0) + \
+              ''.join(' %9.3f' % result['phases'][phaseName] for phaseName in phaseNames) + ' ' + peakMemory
+
+    if jsonPath:
+        report = {'benchmark': 'build', 'seed': seed, 'scale': scale, 'atlasSize': atlasSize.sizeTuple,
+                  'padding': padding, 'sortOn': sortOn, 'alphaThreshold': alphaThreshold, 'format': writerName,
+                  'python': sys.version.split()[0],
+                  'pillow': getattr(Image, '__version__', getattr(Image, 'PILLOW_VERSION', None)), 'corpora': results}
+        jsonFile = open(jsonPath, 'wt')
+        try:
+            json.dump(report, jsonFile, indent=1, sort_keys=True)
+        finally:
+            jsonFile.close()
+        print 'results written to "%s"' % jsonPath
+
+
+BENCHMARKS = {
+    'fit-index': lambda options: benchmarkFitIndex(options.counts, options.sortOn, options.linearLimit, options.seed),
+    'packers': lambda options: benchmarkPackers(options.packCounts, Size(options.maxWidth, options.maxHeight),
+                                                options.padding, options.seed),
+    'placement': lambda options: benchmarkPlacement(options.packCounts, Size(options.maxWidth, options.maxHeight),
+                                                    options.padding, options.seed),
+    'build': lambda options: benchmarkBuild(options.corpora, options.scale, options.corpusDirectory,
+                                            Size(options.maxWidth, options.maxHeight), options.padding, options.sortOn,
+                                            options.alphaThreshold, options.format, options.seed, options.json),
+}
+
+if __name__ == '__main__':
+    USAGE = 'usage: %prog [options] [benchmark ...]'
+
+    parser = optparse.OptionParser(usage=USAGE)
+    parser.add_option('-n', '--counts', action='store', dest='counts', default='1000,5000,20000,50000',
+                      help='comma separated image counts [default "%default"]')
+    parser.add_option('', '--pack-counts', action='store', dest='packCounts', default='500,2000',
+                      help='comma separated image counts for packing benchmarks [default "%default"]')
+    parser.add_option('-W', '--max-width', type='int', action='store', dest='maxWidth', default=1024,
+                      help='max atlas width [default %default]')
+    parser.add_option('-H', '--max-height', type='int', action='store', dest='maxHeight', default=1024,
+                      help='max atlas height [default %default]')
+    parser.add_option('-p', '--padding', type='int', action='store', dest='padding', default=1,
+                      help='atlas image padding [default %default]')
+    parser.add_option('-s', '--sort-on', action='store', dest='sortOn', default='height',
+                      help='sort parameter (width or height) [default "%default"]')
+    parser.add_option('-a', '--alpha-threshold', type='int', action='store', dest='alphaThreshold', default=1,
+                      help='alpha threshold for image trimming in build benchmark [default %default]')
+    parser.add_option('', '--linear-limit', type='int', action='store', dest='linearLimit', default=20000,
+                      help='max image count for linear scan reference [default %default]')
+    parser.add_option('', '--seed', type='int', action='store', dest='seed', default=1,
+                      help='random seed [default %default]')
+    parser.add_option('', '--corpora', action='store', dest='corpora', default=','.join(sorted(CORPORA.keys())),
+                      help='comma separated synthetic corpora for build benchmark [default "%default"]')
+    parser.add_option('', '--scale', type='float', action='store', dest='scale', default=1.0,
+                      help='corpus image count multiplier for build benchmark [default %default]')
+    parser.add_option('', '--corpus-dir', action='store', dest='corpusDirectory',
+                      default=os.path.join(tempfile.gettempdir(), 'atlasbench-corpora'),
+                      help='directory for generated corpora [default "%default"]')
+    parser.add_option('-f', '--format', action='store', dest='format', default='cocos2d',
+                      help='output format for build benchmark (%s) [default "%%default"]' % ', '.join(WRITERS.keys()))
+    parser.add_option('', '--json', action='store', dest='json', default=None,
+                      help='write build benchmark results to JSON file')
+    (options, args) = parser.parse_args()
+    options.counts = [int(count) for count in options.counts.split(',')]
+    options.packCounts = [int(count) for count in options.packCounts.split(',')]
+    options.corpora = options.corpora.split(',')
+    for name in options.corpora:
+        if name not in CORPORA:
+            print '*** Unknown corpus "%s". Possible corpora: %s' % (name, ', '.join(sorted(CORPORA.keys())))
+            exit(1)
+    if options.format not in WRITERS:
+        print '*** Invalid output format. Possible formats: %s' % ', '.join(WRITERS.keys())
+        exit(1)
+
+    names = args or sorted(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            print '*** Unknown benchmark "%s". Possible benchmarks: %s' % (name, ', '.join(sorted(BENCHMARKS.keys())))
+            exit(1)
+    for name in names:
+        BENCHMARKS[name](options)
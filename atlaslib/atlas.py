@@ -1,31 +1,64 @@
 # coding: utf8
+import math
 from PIL import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from util import Size, Point
-from imageinfo import AtlasImageInfo
+from imageinfo import AtlasImageInfo, ScaledImageInfo
+from pngstream import writeBandedPng
 
 class Atlas(object):
     '''Атлас - текстура, вмещающая набор изображений.'''
-    def __init__(self, size, logFile):
-        '''Инициализация с заданным размером.'''
+    def __init__(self, size, logFile, bandHeight=None):
+        '''
+        Инициализация с заданным размером.
+        Если задана высота полосы, текстура атласа не создается: изображения копируются
+        при записи атласа полосами заданной высоты (см. saveImage).
+        Если доступен NumPy, текстура хранится в непрерывном массиве (высота x ширина x 4) байт RGBA:
+        изображения копируются прямо в срезы массива, а Image для записи создается поверх него без копирования.
+        '''
         assert isinstance(size, Size), 'Size must me Size instance'
+        assert bandHeight is None or bandHeight > 0, 'Band height must be positive'
         self.__size = size
-        self.__atlasImage = Image.new("RGBA", size.sizeTuple)
+        self.__bandHeight = bandHeight
+        self.__pixels = None
+        self.__atlasImage = None
+        if bandHeight is None:
+            if numpy is not None:
+                self.__pixels = numpy.zeros((size.height, size.width, 4), numpy.uint8)
+            else:
+                self.__atlasImage = Image.new("RGBA", size.sizeTuple)
         self.__images = []
+        self.__uniqueImages = []
         self.__logFile = logFile
     
-    def placeImage(self, imageInfo, point, isDuplicate=False):
-        '''Размещение изображения в атласе.'''
+    def placeImage(self, imageInfo, point, isDuplicate=False, rotated=False):
+        '''Размещение изображения в атласе (при rotated - с поворотом на 90 градусов по часовой стрелке).'''
         assert isinstance(imageInfo, AtlasImageInfo), 'ImageInfo must be AtlasImageInfo instance'
         assert isinstance(point, Point), 'Point must be Point instance'
         assert point.x >= 0 and point.y >=0, 'Image origin must be within atlas'
-        assert point.x + imageInfo.sourceRect.size.width <= self.__size.width and \
-               point.y + imageInfo.sourceRect.size.height <= self.__size.height, 'Image doesn\'t fit in atlas'
-        imageInfo.placeToAtlasImage(self.__atlasImage, point, isDuplicate)
+        width, height = imageInfo.sourceRect.size.sizeTuple
+        if rotated:
+            width, height = height, width
+        assert point.x + width <= self.__size.width and \
+               point.y + height <= self.__size.height, 'Image doesn\'t fit in atlas'
+        imageInfo.placeToAtlasImage(self.__pixels if self.__pixels is not None else self.__atlasImage,
+                                    point, isDuplicate, rotated)
         self.__images.append(imageInfo)
+        if not isDuplicate:
+            self.__uniqueImages.append(imageInfo)
 
     @property
     def atlasImage(self):
-        '''Текстура атласа.'''
+        '''
+        Текстура атласа (None при записи полосами). Текстура в массиве NumPy отображается в Image только
+        для чтения без копирования; после optimize используется левая верхняя область массива.
+        '''
+        if self.__pixels is not None:
+            return Image.frombuffer('RGBA', self.__size.sizeTuple, self.__pixels, 'raw', 'RGBA',
+                                    self.__pixels.strides[0], 1)
         return self.__atlasImage
     
     @property
@@ -38,29 +71,117 @@ class Atlas(object):
         '''Список изображений в атласе.'''
         return self.__images
     
+    def saveImage(self, fileName, textureFormat=None):
+        '''
+        Запись текстуры атласа в файл PNG.
+        Если задан формат текстуры (TextureFormat), текстура преобразуется и записывается в нем.
+        '''
+        if textureFormat is not None and not textureFormat.isDefault:
+            assert self.__bandHeight is None, 'Texture format conversion requires atlas image'
+            textureFormat.save(self.atlasImage, fileName)
+        elif self.__bandHeight is None:
+            self.atlasImage.save(fileName)
+        else:
+            writeBandedPng(fileName, self.__size, self.__uniqueImages, self.__bandHeight)
+
     def optimize(self):
         '''Оптимизация размера атласа.'''
         # Определяем размер области, занятой изображениями.
         maxX, maxY = 0, 0
         for image in self.__images:
-            maxX = max(maxX, image.atlasPosition.x + image.sourceRect.size.width)
-            maxY = max(maxY, image.atlasPosition.y + image.sourceRect.size.height)
+            minX, minY, imageMaxX, imageMaxY = image.atlasRect.coordinateTuple
+            maxX = max(maxX, imageMaxX)
+            maxY = max(maxY, imageMaxY)
         
         # Ищем минимальную ширину и высоту, способную вместить все изображения.
-        newWidth = self.__size.width
-        while newWidth > maxX:
-            if (newWidth >> 1) < maxX:
-                break
-            newWidth >>= 1
-        newHeight = self.__size.height
-        while newHeight > maxY:
-            if (newHeight >> 1) < maxY:
-                break
-            newHeight >>= 1
+        newWidth, newHeight = optimizedSize(self.__size, Size(maxX, maxY)).sizeTuple
         
-        # Обрезаем атлас по новым размерам.
+        # Обрезаем атлас по новым размерам (массив NumPy не копируется, см. atlasImage).
         if newWidth < self.__size.width or newHeight < self.__size.height:
             newSize = Size(newWidth, newHeight)
             print >> self.__logFile, '* [Atlas] Resizing atlas from (%s) to (%s)' % (self.__size, newSize)
-            self.__atlasImage = self.__atlasImage.crop((0, 0, newWidth, newHeight))
+            if self.__atlasImage is not None:
+                self.__atlasImage = self.__atlasImage.crop((0, 0, newWidth, newHeight))
             self.__size = newSize
+
+    def scaled(self, scale):
+        '''
+        Уменьшенная копия атласа для вывода в масштабе scale (0 < scale <= 1). Каждое изображение
+        вырезается из текстуры атласа и уменьшается отдельно, поэтому соседние изображения не смешиваются.
+        Геометрия изображений масштабируется с округлением (см. ScaledImageInfo); чтобы отступы между
+        изображениями сохранились, при размещении используется отступ packingPadding.
+        '''
+        assert 0 < scale <= 1, 'Scale must be in range (0, 1]'
+        assert self.__bandHeight is None, 'Scaling requires atlas image'
+        atlasImage = self.atlasImage
+        size = Size(int(math.ceil(self.__size.width * scale)), int(math.ceil(self.__size.height * scale)))
+        atlas = Atlas(size, self.__logFile)
+        uniqueImages = set(self.__uniqueImages)
+        for image in self.__images:
+            scaledImage = ScaledImageInfo(image, scale, size)
+            if image in uniqueImages:
+                region = atlasImage.crop(image.atlasRect.coordinateTuple)
+                atlas.__pasteImage(region.resize(scaledImage.atlasRect.size.sizeTuple, Image.LANCZOS),
+                                   scaledImage.atlasPosition)
+                atlas.__uniqueImages.append(scaledImage)
+            atlas.__images.append(scaledImage)
+        return atlas
+
+    #
+    # Приватные методы.
+    #
+
+    def __pasteImage(self, image, position):
+        '''Копирование изображения (Image в режиме RGBA) в текстуру атласа в заданное положение.'''
+        if self.__pixels is not None:
+            width, height = image.size
+            self.__pixels[position.y:position.y + height, position.x:position.x + width] = numpy.asarray(image)
+        else:
+            self.__atlasImage.paste(image, position.pointTuple)
+
+
+def optimizedSize(size, usedSize):
+    '''
+    Возвращает минимальный размер, получаемый из заданного делением сторон пополам
+    и вмещающий область заданного размера.
+        size        исходный размер атласа.
+        usedSize    размер области, занятой изображениями.
+    '''
+    assert isinstance(size, Size), 'Size must be Size instance'
+    assert isinstance(usedSize, Size), 'Size must be Size instance'
+    newWidth = size.width
+    while newWidth > usedSize.width:
+        if (newWidth >> 1) < usedSize.width:
+            break
+        newWidth >>= 1
+    newHeight = size.height
+    while newHeight > usedSize.height:
+        if (newHeight >> 1) < usedSize.height:
+            break
+        newHeight >>= 1
+    return Size(newWidth, newHeight)
+
+def parseScales(text):
+    '''
+    Разбор списка масштабов вывода атласов вида "1,0.5": различные числа в диапазоне (0, 1]
+    относительно исходных изображений. Возбуждает исключение при ошибке.
+    '''
+    try:
+        scales = [float(scale) for scale in text.split(',')]
+    except ValueError:
+        raise Exception('Invalid scales "%s"' % text)
+    if any(not 0 < scale <= 1 for scale in scales) or len(set(scales)) != len(scales):
+        raise Exception('Scales must be distinct numbers in range (0, 1]: "%s"' % text)
+    return scales
+
+def scaleSuffix(scale):
+    '''Суффикс имени атласа в заданном масштабе: пустой для исходного масштаба, иначе вида "@0.5x".'''
+    return scale != 1 and '@%gx' % scale or ''
+
+def packingPadding(padding, scales):
+    '''
+    Отступ для размещения изображений, при котором в уменьшенных копиях атласа (см. Atlas.scaled)
+    расстояние между изображениями остается не меньше padding. Лишний пиксель отступа занимают изображения,
+    которые после уменьшения меньше пикселя и расширяются до него (см. ScaledImageInfo).
+    '''
+    return max([padding] + [int(math.ceil((padding + 1) / scale)) for scale in scales if scale < 1])
@@ -0,0 +1,92 @@
+# coding: utf-8
+from util import Size
+from atlas import optimizedSize
+
+class AtlasLayout(object):
+    '''
+    План атласа - размещение изображений без пиксельных данных.
+    Используется для оценки результата сборки без компоновки и записи атласов.
+    '''
+    def __init__(self, atlasSize, placements, duplicateCount, withoutOptimize):
+        '''
+        Инициализация.
+            atlasSize        размер атласа до оптимизации.
+            placements       список tuple (изображение, координата верхнего левого угла в атласе,
+                             повернуто ли изображение).
+            duplicateCount   количество дубликатов, размещаемых вместе с изображениями.
+            withoutOptimize  не уменьшать размер атласа.
+        '''
+        assert isinstance(atlasSize, Size), 'Size must be Size instance'
+        assert placements, 'Atlas layout must contain images'
+        self.__atlasSize = atlasSize
+        self.__placements = placements
+        self.__duplicateCount = duplicateCount
+        self.__usedSize = usedAtlasSize(placements)
+        self.__size = withoutOptimize and atlasSize or optimizedSize(atlasSize, self.__usedSize)
+        self.__usedArea = sum(image.sourceRect.size.width * image.sourceRect.size.height for image, position, rotated in placements)
+
+    @property
+    def placements(self):
+        '''Список tuple (изображение, координата верхнего левого угла в атласе, повернуто ли изображение).'''
+        return self.__placements
+
+    @property
+    def atlasSize(self):
+        '''Размер атласа после оптимизации.'''
+        return self.__size
+
+    @property
+    def usedSize(self):
+        '''Размер области, занятой изображениями.'''
+        return self.__usedSize
+
+    @property
+    def imageCount(self):
+        '''Количество изображений в атласе, включая дубликаты.'''
+        return len(self.__placements) + self.__duplicateCount
+
+    @property
+    def duplicateCount(self):
+        '''Количество дубликатов.'''
+        return self.__duplicateCount
+
+    @property
+    def texels(self):
+        '''Площадь атласа.'''
+        return self.__size.width * self.__size.height
+
+    @property
+    def usedArea(self):
+        '''Площадь, занятая изображениями (без отступов).'''
+        return self.__usedArea
+
+    @property
+    def wastedArea(self):
+        '''Незанятая площадь атласа.'''
+        return self.texels - self.__usedArea
+
+    @property
+    def occupancy(self):
+        '''Доля площади атласа, занятая изображениями.'''
+        return float(self.__usedArea) / self.texels
+
+    def __str__(self):
+        '''Строковое представление.'''
+        resized = self.__size.sizeTuple != self.__atlasSize.sizeTuple and ' (from %s)' % self.__atlasSize or ''
+        return '%s%s, images %d (duplicates %d), occupancy %.1f%%, wasted %d texels' % \
+               (self.__size, resized, self.imageCount, self.__duplicateCount, self.occupancy * 100.0, self.wastedArea)
+
+
+def usedAtlasSize(placements):
+    '''
+    Размер области атласа, занятой изображениями.
+        placements  список tuple (изображение, координата верхнего левого угла в атласе, повернуто ли изображение).
+    '''
+    maxX, maxY = 0, 0
+    for image, position, rotated in placements:
+        width, height = image.sourceRect.size.sizeTuple
+        if rotated:
+            width, height = height, width
+        maxX = max(maxX, position.x + width)
+        maxY = max(maxY, position.y + height)
+    return Size(maxX, maxY)
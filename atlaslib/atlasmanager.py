@@ -1,20 +1,31 @@
 # coding: utf8
 import os
-from atlas import Atlas
-from imageinfo import AtlasImageInfo
+import itertools
+import multiprocessing
+from atlas import Atlas, scaleSuffix
+from atlaslayout import AtlasLayout
+from imageinfo import AtlasImageInfo, readImageMetadata
 from atlaswriter import WRITERS
+from packer import PACKERS, MAXRECTS_HEURISTICS, MAXRECTS_PACKERS, ATLAS_SIZINGS, shrinkAtlas
+from packsearch import searchPackingStrategy
+from writerpool import AtlasWriterPool
+from metrics import NULL_METRICS
 from util import *
 
 class AtlasManager(object):
     '''Менеджер атласов.'''
 
-    def __init__(self, directory, maxWidth, maxHeight, skipDimensionsSum, alphaThreshold, withoutOptimize, padding, logFile=None):
+    def __init__(self, directory, maxWidth, maxHeight, skipDimensionsSum, alphaThreshold, withoutOptimize, padding, logFile=None,
+                 lazyLoad=False, cache=None, metrics=None):
         '''
         Инициализация менеджера атласов.
             maxWidth     максимальная ширина атласа
             maxHeight         -       высота атласа
             padding      расстояние между соседними изображениями в атласе
             logFile      файл для вывода отладочной информации
+            lazyLoad     декодировать изображения повторно только при размещении в атласе
+            cache        кэш метаданных изображений (MetadataCache)
+            metrics      объект для сбора метрик сборки (BuildMetrics)
         '''
         assert maxWidth > 0 and maxHeight > 0, 'Invalid max texture dimensions'
         assert maxWidth & (maxWidth - 1) == 0, 'Max texture width must be power of 2'
@@ -29,8 +40,14 @@ class AtlasManager(object):
                     pass
             logFile = DummyLog()
 
-        # Список изображений, сгруппированных по sourceRect.size
-        self.__imagesGroupedBySize = {}
+        # Индекс уникальных изображений по контрольной сумме пикселей и списки их дубликатов.
+        self.__imagesByChecksum = {}
+        self.__duplicates = {}
+
+        # Все добавленные изображения (включая дубликаты и пропущенные) по пути к файлу и состояние
+        # их файлов (время модификации, размер) до загрузки - для повторной сборки (см. updateImages).
+        self.__imagesByPath = {}
+        self.__stamps = {}
 
         self.__maxSize = Size(maxWidth, maxHeight)
         self.__skipDimensionsSum = skipDimensionsSum
@@ -38,149 +55,376 @@ class AtlasManager(object):
         self.__padding = padding
         self.__directory = os.path.abspath(directory)
         self.__withoutOptimize = withoutOptimize
+        self.__lazyLoad = lazyLoad
+        self.__cache = cache
+        self.__metrics = metrics or NULL_METRICS
         self.__images = []
         self.__log = logFile
         print >> self.__log, "[AtlasManager] Starting Atlas Manager"
 
+    @property
+    def metrics(self):
+        '''Объект для сбора метрик сборки.'''
+        return self.__metrics
+
     @property
     def count(self):
         '''Возвращает количество изображений.'''
-        return len(self.__images)
+        return len(self.__images) + sum(len(duplicates) for duplicates in self.__duplicates.itervalues())
 
-    def appendImage(self, imageName, imagePath):
+    def appendImage(self, imageName, imagePath, metadata=None):
         '''
         Добавление изображения в набор атласов.
             imageName   имя изображения в атласе.
             imagePath   путь к изображению.
+            metadata    заранее вычисленные метаданные изображения (см. AtlasImageInfo.metadata).
         '''
         # TODO: проверить, не добавлено ли изображение дважды
         shortImagePath = os.path.abspath(imagePath)[len(self.__directory) + 1:]
-        imageInfo = AtlasImageInfo(imageName, imagePath, shortImagePath, self.__alphaThreshold, self.__padding)
-        if imageInfo.sourceRect.size.dimensionsSum > self.__skipDimensionsSum:
-            print >> self.__log, ' * [AtlasManager] skip image', imageInfo.shortPath
-            return
-        print >> self.__log, ' * [AtlasManager] adding image', imageInfo.shortPath
-        if not self.__maxSize.canFit(imageInfo.sourceRect.size):
-            raise Exception('Image "%s": image dimensions (%s) with padding %dpx exceed max atlas size (%s)' % \
-                            (imageName, imageInfo.sourceRect.size, self.__padding, self.__maxSize))
-        if imageInfo.sourceRect.size.sizeTuple not in self.__imagesGroupedBySize.iterkeys():
-            self.__imagesGroupedBySize[imageInfo.sourceRect.size.sizeTuple] = []
-        self.__imagesGroupedBySize[imageInfo.sourceRect.size.sizeTuple].append(imageInfo)
-        self.__images.append(imageInfo)
+        if metadata is None and self.__cache is not None:
+            metadata = self.__cache.get(imagePath, self.__alphaThreshold)
+            if metadata is not None:
+                self.__metrics.addCount('cacheHits')
+        imageInfo = AtlasImageInfo(imageName, imagePath, shortImagePath, self.__alphaThreshold, self.__padding,
+                                   self.__lazyLoad, metadata, self.__metrics)
+        if self.__cache is not None:
+            self.__cache.put(imagePath, self.__alphaThreshold, imageInfo.metadata)
+        self.__imagesByPath[imagePath] = imageInfo
+        self.__addImage(imageInfo)
 
-    def generateAtlases(self, basePath, sortOn, writer):
+    def appendImages(self, images, workers=1):
+        '''
+        Добавление набора изображений в набор атласов.
+            images      список пар (имя изображения, путь к изображению).
+            workers     количество процессов для загрузки изображений.
+        Изображения добавляются в порядке следования в списке независимо от количества процессов.
+        '''
+        assert workers > 0, 'Workers count must be positive'
+        self.__stamps.update((imagePath, fileStamp(imagePath)) for imageName, imagePath in images)
+        for (imageName, imagePath), metadata in itertools.izip(images, self.__readMetadata(images, workers)):
+            self.appendImage(imageName, imagePath, metadata)
+
+    def updateImages(self, images, workers=1):
+        '''
+        Обновление набора изображений перед повторной сборкой атласов (режим наблюдения за каталогом).
+        Новые изображения и изображения, файлы которых изменились (время модификации или размер),
+        загружаются, удаленные исключаются, для остальных используются ранее вычисленные метаданные.
+        Индекс дубликатов строится заново в порядке списка, как при добавлении в новый менеджер.
+            images      полный список пар (имя изображения, путь к изображению).
+            workers     количество процессов для загрузки изображений.
+        Возвращает количество загруженных изображений.
+        '''
+        assert workers > 0, 'Workers count must be positive'
+        stamps = dict((imagePath, fileStamp(imagePath)) for imageName, imagePath in images)
+        changedImages = [(imageName, imagePath) for imageName, imagePath in images
+                         if imagePath not in self.__imagesByPath or self.__stamps.get(imagePath) != stamps[imagePath] or \
+                            self.__imagesByPath[imagePath].name != imageName]
+        loadedMetadata = dict((imagePath, metadata) for (imageName, imagePath), metadata in
+                              itertools.izip(changedImages, self.__readMetadata(changedImages, workers)))
+
+        # Индексы строим заново. Состояние файлов обновляем только после успешного добавления всех
+        # изображений, чтобы после ошибки изменившиеся изображения были загружены повторно.
+        print >> self.__log, '[AtlasManager] updating images (loaded %d, total %d)' % (len(changedImages), len(images))
+        self.__imagesByChecksum = {}
+        self.__duplicates = {}
+        self.__images = []
+        for imageName, imagePath in images:
+            if imagePath in loadedMetadata:
+                self.appendImage(imageName, imagePath, loadedMetadata[imagePath])
+            else:
+                self.__addImage(self.__imagesByPath[imagePath])
+        self.__imagesByPath = dict((imagePath, self.__imagesByPath[imagePath]) for imageName, imagePath in images)
+        self.__stamps = stamps
+        return len(changedImages)
+
+    def searchPackingStrategy(self, sortOn, packer='guillotine', heuristic=None, workers=1, timeLimit=None,
+                              allowRotation=False, packers=None):
+        '''
+        Поиск стратегии размещения (параметр сортировки, алгоритм, эвристика и размер атласа),
+        дающей наименьшее количество атласов и наименьшую их суммарную площадь.
+        Используется только геометрия изображений, вычисленная при их добавлении.
+            sortOn, packer, heuristic  базовая стратегия.
+            workers      количество процессов.
+            timeLimit    ограничение времени поиска в секундах.
+            allowRotation  разрешить поворот изображений на 90 градусов.
+            packers      алгоритмы размещения для перебора, по умолчанию все.
+        Возвращает словарь с ключами sortOn, packer, heuristic, atlasSize, который можно передать
+        в generateAtlases.
+        '''
+        assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
+        assert packer in PACKERS, 'Unknown packer'
+        if packer in MAXRECTS_PACKERS:
+            heuristic = heuristic or MAXRECTS_HEURISTICS[0]
+        baseStrategy = {'sortOn': sortOn, 'packer': packer, 'heuristic': heuristic, 'atlasSize': self.__maxSize.sizeTuple}
+        if not self.__images:
+            return baseStrategy
+        sizes = [image.sourceRect.size.sizeTuple for image in self.__images]
+        return searchPackingStrategy(sizes, self.__padding, self.__maxSize, self.__withoutOptimize, baseStrategy,
+                                     workers, timeLimit, self.__log, allowRotation, packers)
+
+    def planLayout(self, sortOn, packer='guillotine', heuristic=None, atlasSize=None, sizing=None, allowRotation=False):
+        '''
+        Размещение изображений без компоновки и записи атласов: используется только геометрия
+        изображений, состояние менеджера не изменяется.
+            sortOn       параметр сортировки атласов (ширина или высота)
+            packer       алгоритм размещения изображений (см. PACKERS)
+            heuristic    эвристика выбора положения изображения для алгоритма размещения
+            atlasSize    размер атласа (ширина, высота), по умолчанию максимальный
+            sizing       уменьшение атласов повторным размещением (см. ATLAS_SIZINGS)
+            allowRotation  разрешить поворот изображений на 90 градусов
+        Возвращает список объектов AtlasLayout.
+        '''
+        assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
+        assert packer in PACKERS, 'Unknown packer'
+        assert sizing is None or (sizing in ATLAS_SIZINGS and not self.__withoutOptimize), 'Invalid atlas sizing'
+        atlasSize = atlasSize and Size(*atlasSize) or self.__maxSize
+        assert self.__maxSize.canFit(atlasSize), 'Atlas size must not exceed max atlas size'
+
+        layouts = []
+        packerName, packer = packer, PACKERS[packer](self.__images, atlasSize, self.__padding, sortOn, heuristic, allowRotation,
+                                                     self.__metrics)
+        while packer:
+            with self.__metrics.measure('pack'):
+                placements = packer.packAtlas()
+            layoutSize = atlasSize
+            if sizing is not None:
+                layoutSize, placements = shrinkAtlas(packerName, placements, atlasSize, self.__padding, sortOn, heuristic,
+                                                     sizing, allowRotation)
+            duplicateCount = sum(len(self.__duplicates[image]) for image, position, rotated in placements)
+            layouts.append(AtlasLayout(layoutSize, placements, duplicateCount, self.__withoutOptimize or sizing == 'mul4'))
+        return layouts
+
+    def generateAtlases(self, basePath, sortOn, writer, manifest=None, packer='guillotine', heuristic=None, atlasSize=None,
+                        writeJobs=1, bandHeight=None, sizing=None, allowRotation=False, textureFormat=None, scales=None):
         '''
         Создание атласов и их описаний.
             basePath     путь и префикс имени файла с атласом
             sortOn       параметр сортировки атласов (ширина или высота)
             writer         объект для записи атласов
+            manifest     манифест предыдущей сборки (BuildManifest) для инкрементальной сборки
+            packer       алгоритм размещения изображений (см. PACKERS)
+            heuristic    эвристика выбора положения изображения для алгоритма размещения
+            atlasSize    размер атласа (ширина, высота), по умолчанию максимальный
+            writeJobs    количество потоков записи атласов (0 - запись в текущем потоке)
+            bandHeight   высота полосы для записи атласов полосами без создания текстуры в памяти
+            sizing       уменьшение атласов повторным размещением (см. ATLAS_SIZINGS)
+            allowRotation  разрешить поворот изображений на 90 градусов
+            textureFormat  формат записи текстуры (TextureFormat), по умолчанию RGBA8888 PNG
+            scales       масштабы вывода атласов (см. parseScales), по умолчанию только исходный;
+                         атласы в масштабе, отличном от 1, записываются с суффиксом имени (см. scaleSuffix)
+        Возвращает количество атласов, включая сохраненные без изменений.
         '''
         assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
         assert writer in WRITERS, 'Unknown writer'
+        assert bandHeight is None or textureFormat is None or textureFormat.isDefault, \
+               'Texture format conversion cannot be used with band writing'
+        assert scales is None or (bandHeight is None and packer in MAXRECTS_PACKERS), \
+               'Scaling requires atlas image and packer keeping padding between images'
+        assert packer in PACKERS, 'Unknown packer'
+        assert sizing is None or (sizing in ATLAS_SIZINGS and not self.__withoutOptimize), 'Invalid atlas sizing'
+        atlasSize = atlasSize and Size(*atlasSize) or self.__maxSize
+        assert self.__maxSize.canFit(atlasSize), 'Atlas size must not exceed max atlas size'
 
         print >> self.__log, '[AtlasManager] generating atlases'
 
-        # Сортируем изображения в порядке увеличения параметра сортировки (будем искать подходящее
-        # по размерам изображение начиная с конца.
-        self.__images.sort(key=lambda i: getattr(i.paddedSourceRect.size, sortOn))
-        writer = WRITERS[writer]()
-
-        # Размещаем изображения.
-        atlasIndex = 0
-        while self.__images:
-            # Количество помещенных изображений
-            imageCount = 0
-            # Количество дубликатов
-            duplicateCount = 0
-
-            atlas = Atlas(self.__maxSize, self.__log)
-
-            areas = [Rect(Point(0, 0), self.__maxSize)]
-            while areas:
-                # Ищем изображение, максимально подходящее по размеру.
-                area = areas.pop()
-                image = self.__retainMostFittableImage(area.size)
-
-                # Если изображение не найдено, переходим к следующей области.
-                if image is None:
-                    continue
+        buildOptions = {'maxWidth': atlasSize.width, 'maxHeight': atlasSize.height, 'padding': self.__padding,
+                        'alphaThreshold': self.__alphaThreshold, 'withoutOptimize': self.__withoutOptimize,
+                        'sortOn': sortOn, 'writer': writer, 'packer': packer, 'heuristic': heuristic, 'sizing': sizing,
+                        'allowRotation': allowRotation}
+        if textureFormat is not None and not textureFormat.isDefault:
+            buildOptions['textureFormat'] = str(textureFormat)
+        if scales is not None:
+            buildOptions['scales'] = scales
+        writer = WRITERS[writer](textureFormat)
+        scales = scales or [1]
+
+        # Сборка может повторяться (см. updateImages), поэтому сбрасываем размещение изображений.
+        for image in self.__images:
+            for groupImage in [image] + self.__duplicates[image]:
+                groupImage.resetPlacement()
+
+        # Не пересобираем атласы, изображения которых не изменились.
+        images = self.__images
+        keptIndices = set()
+        previousIndices = set()
+        if manifest is not None:
+            previousIndices = set(manifest.atlases.iterkeys())
+            keptIndices, images = self.__retainUnchangedAtlases(basePath, writer, manifest, buildOptions, scales)
+
+        packerName, packer = packer, PACKERS[packer](images, atlasSize, self.__padding, sortOn, heuristic, allowRotation,
+                                                     self.__metrics)
+
+        # Размещаем изображения. Атласы записываются в фоновых потоках, пока размещаются следующие.
+        writerPool = AtlasWriterPool(writer, writeJobs, self.__metrics)
+        try:
+            atlasIndex = 0
+            atlasCount = len(keptIndices)
+            while packer:
+                # Индексы сохраненных атласов пропускаем.
+                while atlasIndex in keptIndices:
+                    atlasIndex += 1
+
+                # Количество помещенных изображений
+                imageCount = 0
+                # Количество дубликатов
+                duplicateCount = 0
 
-                # Размещаем изображение в верхний левый угол области и делим оставшееся пространство.
-                atlas.placeImage(image, area.origin)
-                areas.extend(self.__splitRect(area, image.paddedSourceRect.size, sortOn))
-                imageCount += 1
+                # Уменьшаем атлас, повторно размещая его изображения в атласах меньшего размера.
+                with self.__metrics.measure('pack'):
+                    placements = packer.packAtlas()
+                size = atlasSize
+                if sizing is not None:
+                    with self.__metrics.measure('shrink'):
+                        size, placements = shrinkAtlas(packerName, placements, atlasSize, self.__padding, sortOn, heuristic,
+                                                       sizing, allowRotation)
 
-                # Ищем оставшиеся дубликаты изображения
-                groupImages = self.__imagesGroupedBySize[image.sourceRect.size.sizeTuple]
-                groupImages.remove(image)
+                atlas = Atlas(size, self.__log, bandHeight)
 
-                for dupeImage in list(groupImages):
-                    if dupeImage.isEqual(image):
-                        groupImages.remove(dupeImage)
-                        atlas.placeImage(dupeImage, area.origin, isDuplicate=True)
+                for image, position, rotated in placements:
+                    atlas.placeImage(image, position, rotated=rotated)
+                    imageCount += 1
+
+                    # Размещаем дубликаты изображения в той же области.
+                    for dupeImage in self.__duplicates[image]:
+                        atlas.placeImage(dupeImage, position, isDuplicate=True, rotated=rotated)
                         duplicateCount += 1
                         imageCount += 1
-                        self.__images.remove(dupeImage)
 
-            # Записываем атлас.
-            if not self.__withoutOptimize:
-                atlas.optimize()
-            atlasName = basePath + str(atlasIndex)
-            writer.writeAtlas(atlasName, atlas)
-            atlasIndex += 1
-            print >> self.__log, ' * [AtlasManager] writing atlas "%s" (images %d, duplicates %d%%)' % (os.path.basename(atlasName),
-                imageCount, float(duplicateCount) / imageCount * 100.0)
+                # Записываем атлас.
+                if not self.__withoutOptimize and sizing != 'mul4':
+                    with self.__metrics.measure('optimize'):
+                        atlas.optimize()
+                atlasName = basePath + str(atlasIndex)
+                for scale in scales:
+                    if scale == 1:
+                        writerPool.writeAtlas(atlasName, atlas)
+                        continue
+                    with self.__metrics.measure('scale'):
+                        scaledAtlas = atlas.scaled(scale)
+                    writerPool.writeAtlas(atlasName + scaleSuffix(scale), scaledAtlas)
+                if manifest is not None:
+                    manifest.addAtlas(atlasIndex, atlas)
+                previousIndices.discard(atlasIndex)
+                atlasIndex += 1
+                atlasCount += 1
+                print >> self.__log, ' * [AtlasManager] writing atlas "%s" (images %d, duplicates %d%%)' % (os.path.basename(atlasName),
+                    imageCount, float(duplicateCount) / imageCount * 100.0)
+            writerPool.join()
+        finally:
+            # При ошибке размещения или записи атласы из очереди не записываются, но потоки записи завершаются.
+            writerPool.abort()
+
+        # Удаляем атласы предыдущей сборки, которые не были сохранены или перезаписаны.
+        for staleIndex in previousIndices - keptIndices:
+            for fileName in self.__atlasFiles(writer, basePath + str(staleIndex), scales):
+                if os.path.exists(fileName):
+                    print >> self.__log, ' * [AtlasManager] removing stale file "%s"' % os.path.basename(fileName)
+                    os.remove(fileName)
+        if manifest is not None:
+            manifest.save()
+        return atlasCount
+
+    def __addImage(self, imageInfo):
+        '''Добавление загруженного изображения в список размещаемых изображений или в список дубликатов.'''
+        if imageInfo.sourceRect.size.dimensionsSum > self.__skipDimensionsSum:
+            print >> self.__log, ' * [AtlasManager] skip image', imageInfo.shortPath
+            return
+        print >> self.__log, ' * [AtlasManager] adding image', imageInfo.shortPath
+        if not self.__maxSize.canFit(imageInfo.sourceRect.size):
+            raise Exception('Image "%s": image dimensions (%s) with padding %dpx exceed max atlas size (%s)' % \
+                            (imageInfo.name, imageInfo.sourceRect.size, self.__padding, self.__maxSize))
+
+        # Дубликаты не участвуют в размещении, а занимают место уже добавленного изображения.
+        originalImage = self.__imagesByChecksum.get(imageInfo.checksum)
+        if originalImage is not None:
+            self.__duplicates[originalImage].append(imageInfo)
+            self.__metrics.addCount('duplicates')
+            return
+        self.__imagesByChecksum[imageInfo.checksum] = imageInfo
+        self.__duplicates[imageInfo] = []
+        self.__images.append(imageInfo)
 
-    def __retainMostFittableImage(self, targetSize):
+    def __readMetadata(self, images, workers):
         '''
-        Возвращает наибольшее изображение, помещающееся в заданный регион и удаляет его из списка изображений.
-        Если изображение не найдено, возвращает None.
+        Генератор метаданных изображений в порядке следования в списке. При загрузке в одном процессе
+        возвращает None: изображение загружается при добавлении (см. appendImage).
+            images      список пар (имя изображения, путь к изображению).
+            workers     количество процессов для загрузки изображений.
         '''
-        assert isinstance(targetSize, Size), 'Size must be Size instance'
+        if workers == 1 or len(images) < 2:
+            for image in images:
+                yield None
+            return
 
-        # Изображения уже отсортированы по размеру. Ищем первое подходящее с конца.
-        for image in reversed(self.__images):
-            if targetSize.canFit(image.sourceRect.size):
-                self.__images.remove(image)
-                return image
-        return None
+        # Метаданные, найденные в кэше, не вычисляем повторно.
+        if self.__cache is not None:
+            cachedMetadata = [self.__cache.get(imagePath, self.__alphaThreshold) for imageName, imagePath in images]
+        else:
+            cachedMetadata = [None] * len(images)
+        missingPaths = [imagePath for (imageName, imagePath), metadata in zip(images, cachedMetadata) if metadata is None]
+        self.__metrics.addCount('cacheHits', len(images) - len(missingPaths))
+        collectMetrics = self.__metrics.enabled
+        if len(missingPaths) < 2:
+            for (imageName, imagePath), metadata in zip(images, cachedMetadata):
+                if metadata is None:
+                    metadata, metricsReport = readImageMetadata((imagePath, self.__alphaThreshold, collectMetrics))
+                    if metricsReport is not None:
+                        self.__metrics.merge(metricsReport)
+                yield metadata
+            return
+
+        # Дочерние процессы загружают и обрезают изображения, а обратно передают только метаданные.
+        print >> self.__log, '[AtlasManager] loading %d images using %d processes' % (len(missingPaths), workers)
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunkSize = max(1, min(64, len(missingPaths) / (workers * 4)))
+            loadedMetadata = pool.imap(readImageMetadata, [(imagePath, self.__alphaThreshold, collectMetrics)
+                                                           for imagePath in missingPaths], chunkSize)
+            for (imageName, imagePath), metadata in zip(images, cachedMetadata):
+                if metadata is None:
+                    metadata, metricsReport = loadedMetadata.next()
+                    if metricsReport is not None:
+                        self.__metrics.merge(metricsReport)
+                yield metadata
+        finally:
+            pool.terminate()
+            pool.join()
 
-    def __splitRect(self, rect, size, sortOn):
+    def __retainUnchangedAtlases(self, basePath, writer, manifest, buildOptions, scales):
         '''
-        Возвращает tuple из прямоугольников (от нуля до двух), получаемых разделением
-        исходного заданной областью.
+        Исключение из размещения изображений, входящих в атласы предыдущей сборки, которые не требуют
+        пересборки: параметры сборки, состав и содержимое изображений не изменились, а файлы атласа на месте.
+        Возвращает tuple (множество индексов сохраненных атласов, список размещаемых изображений).
         '''
-        assert isinstance(rect, Rect), 'Rect must be Rect instance'
-        assert isinstance(size, Size), 'Rect must be Size instance'
-        assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
+        keptIndices = set()
+        images = self.__images
+        if manifest.options == buildOptions:
+            imagesByPath = {}
+            for image in self.__images:
+                for groupImage in [image] + self.__duplicates[image]:
+                    imagesByPath[groupImage.shortPath] = (groupImage, image)
+            for atlasIndex, records in sorted(manifest.atlases.iteritems()):
+                recordPaths = set(shortPath for shortPath, name, checksum, x, y in records)
+                unchanged = all(shortPath in imagesByPath and imagesByPath[shortPath][0].name == name and \
+                                imagesByPath[shortPath][0].checksum == checksum for shortPath, name, checksum, x, y in records)
+
+                # Изображение и все его дубликаты должны находиться в одном атласе.
+                unchanged = unchanged and all(groupImage.shortPath in recordPaths for shortPath in recordPaths
+                                              for groupImage in [imagesByPath[shortPath][1]] + self.__duplicates[imagesByPath[shortPath][1]])
+                if not unchanged or not all(os.path.exists(fileName) for fileName in self.__atlasFiles(writer, basePath + str(atlasIndex), scales)):
+                    continue
+                keptIndices.add(atlasIndex)
+                for shortPath in recordPaths:
+                    del imagesByPath[shortPath]
+                print >> self.__log, ' * [AtlasManager] keeping atlas "%s" (images %d)' % \
+                                     (os.path.basename(basePath + str(atlasIndex)), len(records))
+
+            # Оставляем для размещения только изображения из изменившихся атласов и новые изображения.
+            retainedImages = set(image for groupImage, image in imagesByPath.itervalues())
+            images = [image for image in self.__images if image in retainedImages]
+        manifest.reset(buildOptions, keptIndices)
+        return keptIndices, images
 
-        # Если размеры разделяющего прямоугольника больше, чем у разделяемого, обрезаем разделяющий.
-        size = Size(min(size.width, rect.size.width), min(size.height, rect.size.height))
-
-        # Создаем прямоугольники справа и снизу.
-        rects = []
-
-        if sortOn == 'height':
-#            ┌───┬───┐
-#            │ 3 │ 2 │
-#            ├───┴───┤
-#            │   1   │
-#            └───────┘
-            if rect.size.height != size.height:
-                rects.append(Rect(Point(rect.origin.x, rect.origin.y + size.height), Size(rect.size.width, rect.size.height - size.height)))
-
-            if rect.size.width != size.width:
-                rects.append(Rect(Point(rect.origin.x + size.width, rect.origin.y), Size(rect.size.width - size.width, size.height)))
-
-        elif sortOn == 'width':
-#            ┌───┬───┐
-#            │ 3 │   │
-#            ├───┤ 1 │
-#            │ 2 │   │
-#            └───┴───┘
-            if rect.size.width != size.width:
-                rects.append(Rect(Point(rect.origin.x + size.width, rect.origin.y), Size(rect.size.width - size.width, rect.size.height)))
-
-            if rect.size.height != size.height:
-                rects.append(Rect(Point(rect.origin.x, rect.origin.y + size.height), Size(size.width, rect.size.height - size.height)))
-        return rects
+    def __atlasFiles(self, writer, atlasName, scales):
+        '''Список файлов атласа во всех масштабах вывода.'''
+        return [fileName for scale in scales for fileName in writer.atlasFiles(atlasName + scaleSuffix(scale))]
@@ -1,22 +1,37 @@
 # coding: utf8
+import os
 from util import Rect, Size
 from atlas import Atlas
+from binaryatlas import packBinaryAtlas
+from pixelformat import TextureFormat
 
 # Классы для экспорта атласов.
 WRITERS = {}
 
 class Cocos2dWriter(object):
     '''Класс для эскпорта атласов в формате cocos2d plist'''
-    def __init__(self):
-        pass
+    def __init__(self, textureFormat=None):
+        '''
+        Инициализация.
+            textureFormat  формат записи текстуры (TextureFormat), по умолчанию RGBA8888 PNG.
+        '''
+        self.__textureFormat = textureFormat or TextureFormat()
     
     def imageName(self, image):
         return image.name
     
+    def atlasFiles(self, baseName):
+        '''Список файлов, создаваемых при записи атласа.'''
+        atlasFileName = baseName + self.__textureFormat.extension
+        return [atlasFileName, atlasFileName + '.plist']
+
     def writeAtlas(self, baseName, atlas):
         assert isinstance(atlas, Atlas), 'Atlas must be Atlas instance'
-        atlasFileName = baseName + '.png'
-        atlas.atlasImage.save(atlasFileName)
+        atlasFileName = baseName + self.__textureFormat.extension
+        atlas.saveImage(atlasFileName, self.__textureFormat)
+
+        # Поворот изображений поддерживается начиная со второй версии формата.
+        hasRotation = any(image.rotated for image in atlas.images)
 
         plist = file(atlasFileName + '.plist', 'wt')
         print >> plist, '<?xml version="1.0" encoding="UTF-8"?>'
@@ -37,6 +52,9 @@ class Cocos2dWriter(object):
             print >> plist, '            <string>%s</string>' % self.__formatRect(Rect(image.atlasPosition, image.sourceRect.size))
             print >> plist, '            <key>offset</key>'
             print >> plist, '            <string>{%.1f, %.1f}</string>' % (offsetX, offsetY)
+            if hasRotation:
+                print >> plist, '            <key>rotated</key>'
+                print >> plist, '            <%s/>' % (image.rotated and 'true' or 'false')
             print >> plist, '            <key>sourceColorRect</key>'
             print >> plist, '            <string>%s</string>' % self.__formatRect(image.sourceRect)
             print >> plist, '            <key>sourceSize</key>'
@@ -46,9 +64,16 @@ class Cocos2dWriter(object):
         print >> plist, '    <key>metadata</key>'
         print >> plist, '    <dict>'
         print >> plist, '        <key>format</key>'
-        print >> plist, '        <integer>1</integer>'
+        print >> plist, '        <integer>%d</integer>' % (hasRotation and 2 or 1)
         print >> plist, '        <key>size</key>'
         print >> plist, '        <string>%s</string>' % self.__formatSize(atlas.atlasSize)
+        if not self.__textureFormat.isDefault:
+            print >> plist, '        <key>pixelFormat</key>'
+            print >> plist, '        <string>%s</string>' % self.__textureFormat.pixelFormatName
+            print >> plist, '        <key>premultiplyAlpha</key>'
+            print >> plist, '        <%s/>' % (self.__textureFormat.premultipliedAlpha and 'true' or 'false')
+            print >> plist, '        <key>textureFileName</key>'
+            print >> plist, '        <string>%s</string>' % os.path.basename(atlasFileName)
         print >> plist, '    </dict>'
         print >> plist, '</dict>'
         print >> plist, '</plist>'
@@ -68,23 +93,33 @@ WRITERS['cocos2d-with-path'] = Cocos2dWriterWithFullPath
 
 class OgreWriter(object):
     ''' Класс для экспорта атласов в формате info '''
-    def __init__(self):
-        pass
+    def __init__(self, textureFormat=None):
+        '''
+        Инициализация.
+            textureFormat  формат записи текстуры (TextureFormat), по умолчанию RGBA8888 PNG.
+        '''
+        self.__textureFormat = textureFormat or TextureFormat()
+
+    def atlasFiles(self, baseName):
+        '''Список файлов, создаваемых при записи атласа.'''
+        return [baseName + self.__textureFormat.extension, baseName + '.atlas']
 
     def writeAtlas(self, baseName, atlas):
         assert isinstance(atlas, Atlas), 'Atlas must be Atlas instance'
 
-        atlasImageName = baseName + '.png'
-        atlas.atlasImage.save(atlasImageName)
+        atlasImageName = baseName + self.__textureFormat.extension
+        atlas.saveImage(atlasImageName, self.__textureFormat)
 
         atlasFileName = baseName + '.atlas'
 
         info = open(atlasFileName, 'wt')
 
-        import os
-
         print >> info, 'atlas %s' % os.path.split(os.path.abspath(atlasImageName))[-1]
         print >> info, '{'
+        if not self.__textureFormat.isDefault:
+            print >> info, '    pixelFormat %s' % self.__textureFormat.pixelFormatName
+            if self.__textureFormat.premultipliedAlpha:
+                print >> info, '    premultipliedAlpha 1'
 
         for image in sorted(atlas.images, key=lambda image: image.path):
 
@@ -109,8 +144,45 @@ class OgreWriter(object):
             print >> info, '        sourceSize %d %d' % sourceSize
             print >> info, '        sourceRect %d %d %d %d' % sourceRect
             print >> info, '        offset %d %d' % offset
+            if image.rotated:
+                print >> info, '        rotated 1'
 
             print >> info, '    }'
         print >> info, '}'
 
 WRITERS['ogre'] = OgreWriter
+
+class BinaryWriter(object):
+    '''
+    Класс для экспорта атласов в двоичном формате (см. binaryatlas): описание атласа
+    отображается в память и читается без разбора текста.
+    '''
+    def __init__(self, textureFormat=None):
+        '''
+        Инициализация.
+            textureFormat  формат записи текстуры (TextureFormat), по умолчанию RGBA8888 PNG.
+        '''
+        self.__textureFormat = textureFormat or TextureFormat()
+
+    def imageName(self, image):
+        return image.name
+
+    def atlasFiles(self, baseName):
+        '''Список файлов, создаваемых при записи атласа.'''
+        return [baseName + self.__textureFormat.extension, baseName + '.atlasbin']
+
+    def writeAtlas(self, baseName, atlas):
+        assert isinstance(atlas, Atlas), 'Atlas must be Atlas instance'
+        # Описание формируется до записи текстуры: если кадр не помещается в формат, файлы не создаются.
+        frames = [(self.imageName(image),) + image.atlasPosition.pointTuple + image.sourceRect.size.sizeTuple +
+                  image.sourceRect.origin.pointTuple + image.originalSize.sizeTuple + (image.rotated,)
+                  for image in atlas.images]
+        data = packBinaryAtlas(atlas.atlasSize.sizeTuple, frames, self.__textureFormat)
+        atlas.saveImage(baseName + self.__textureFormat.extension, self.__textureFormat)
+
+        atlasFile = open(baseName + '.atlasbin', 'wb')
+        try:
+            atlasFile.write(data)
+        finally:
+            atlasFile.close()
+WRITERS['binary'] = BinaryWriter
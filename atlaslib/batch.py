@@ -0,0 +1,283 @@
+# coding: utf-8
+import os
+import json
+import time
+import multiprocessing
+from PIL import Image
+from atlasmanager import AtlasManager
+from atlas import parseScales, packingPadding
+from atlaswriter import WRITERS
+from buildmanifest import BuildManifest
+from metrics import peakMemoryKB
+from packer import PACKERS, MAXRECTS_HEURISTICS, MAXRECTS_PACKERS, ATLAS_SIZINGS
+from pixelformat import TextureFormat, PIXEL_FORMATS, TEXTURE_CONTAINERS
+from watcher import findImages
+
+# Параметры сборки группы (совпадают с именами параметров командной строки atlastool.py).
+GROUP_OPTIONS = ('directory', 'outputDirectory', 'outputName', 'format', 'maxWidth', 'maxHeight', 'padding', 'sortOn',
+                 'packer', 'heuristic', 'allowRotation', 'search', 'searchTime', 'skipDimensionSum', 'alphaThreshold',
+                 'dontOptimize', 'sizing', 'lazyLoad', 'incremental', 'writeJobs', 'bandHeight', 'pixelFormat',
+                 'dither', 'textureContainer', 'scales')
+
+# Параметры, задающие пути; в файле конфигурации они указываются относительно каталога файла.
+PATH_OPTIONS = ('directory', 'outputDirectory')
+
+# Разделитель префикса имен файлов атласов группы и номера атласа, чтобы имена атласов групп
+# с префиксами вида "a" и "a1" не совпадали (атлас 10 первой и атлас 0 второй группы).
+ATLAS_INDEX_SEPARATOR = '-'
+
+# Оценка расхода памяти процессом сборки без учета изображений и атласов (интерпретатор и PIL).
+BASE_MEMORY = 32 << 20
+
+def loadBatchConfig(path, defaults):
+    '''
+    Загрузка групп из файла конфигурации JSON вида
+        {"defaults": {параметры}, "groups": [{"name": имя, "directory": каталог, параметры}, ...]}
+    Параметры групп переопределяют параметры defaults, а те - заданные значения по умолчанию
+    (кроме outputName: по умолчанию префикс имен файлов атласов - имя группы).
+        path        путь к файлу конфигурации.
+        defaults    словарь параметров по умолчанию (см. GROUP_OPTIONS).
+    Возвращает список словарей параметров групп с ключом name.
+    '''
+    configFile = open(path, 'rt')
+    try:
+        config = json.load(configFile)
+    finally:
+        configFile.close()
+    baseDirectory = os.path.dirname(os.path.abspath(path))
+
+    def configOptions(options, groupName):
+        '''Параметры из файла конфигурации с проверкой имен и путями относительно файла.'''
+        result = {}
+        for key, value in options.iteritems():
+            key = str(key)
+            if key not in GROUP_OPTIONS:
+                raise Exception('Unknown option "%s" in batch group "%s"' % (key, groupName))
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            if key in PATH_OPTIONS:
+                value = os.path.join(baseDirectory, value)
+            result[key] = value
+        return result
+
+    # Префикс имен файлов атласов по умолчанию - имя группы.
+    commonOptions = dict(defaults)
+    commonOptions.pop('outputName', None)
+    commonOptions.update(configOptions(config.get('defaults', {}), 'defaults'))
+    groups = []
+    for groupConfig in config.get('groups', []):
+        groupConfig = dict(groupConfig)
+        if 'name' not in groupConfig:
+            raise Exception('Batch group must have name')
+        name = groupConfig.pop('name').encode('utf-8')
+        group = dict(commonOptions)
+        group.update(configOptions(groupConfig, name))
+        group['name'] = name
+        group.setdefault('outputName', name)
+        if group.get('directory') is None:
+            raise Exception('Batch group "%s" must have directory' % name)
+        groups.append(group)
+    return groups
+
+def subdirectoryGroups(directory, defaults):
+    '''
+    Группы по одной на каждый подкаталог заданного каталога (в алфавитном порядке).
+    Имя группы и префикс имен файлов атласов - имя подкаталога.
+    '''
+    groups = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isdir(path):
+            continue
+        group = dict(defaults)
+        group.update({'name': name, 'directory': path, 'outputName': name})
+        groups.append(group)
+    return groups
+
+def checkGroup(group):
+    '''Проверка параметров группы. Возбуждает исключение с описанием ошибки.'''
+    if group['sortOn'] not in ('width', 'height'):
+        raise Exception('Sort parameter must be either width or height')
+    if group['packer'] not in PACKERS:
+        raise Exception('Invalid packer. Possible packers: %s' % ', '.join(sorted(PACKERS.keys())))
+    if group['heuristic'] is not None and (group['packer'] not in MAXRECTS_PACKERS or group['heuristic'] not in MAXRECTS_HEURISTICS):
+        raise Exception('Heuristic must be used with %s packer. Possible heuristics: %s' % \
+                        (' or '.join(MAXRECTS_PACKERS), ', '.join(MAXRECTS_HEURISTICS)))
+    if group['sizing'] is not None and (group['sizing'] not in ATLAS_SIZINGS or group['dontOptimize']):
+        raise Exception('Shrink mode must be one of %s and cannot be used with dontOptimize' % ', '.join(ATLAS_SIZINGS))
+    if group['pixelFormat'] not in PIXEL_FORMATS or group['textureContainer'] not in TEXTURE_CONTAINERS:
+        raise Exception('Pixel format must be one of %s and texture container one of %s' % \
+                        (', '.join(PIXEL_FORMATS), ', '.join(TEXTURE_CONTAINERS)))
+    if group['scales'] is not None:
+        parseScales(group['scales'])
+        if group['bandHeight'] or group['packer'] not in MAXRECTS_PACKERS:
+            raise Exception('Scales cannot be used with bandHeight and require %s packer' % ' or '.join(MAXRECTS_PACKERS))
+    if group['format'] not in WRITERS:
+        raise Exception('Invalid output format. Possible formats: %s' % ', '.join(WRITERS.keys()))
+
+def checkGroupOutputs(groups):
+    '''
+    Проверка, что атласы групп записываются в разные файлы: пары (каталог, префикс имен файлов)
+    не должны повторяться. Возбуждает исключение с описанием ошибки.
+    '''
+    outputs = {}
+    for group in groups:
+        output = (os.path.normcase(os.path.abspath(group['outputDirectory'])), group['outputName'])
+        if output in outputs:
+            raise Exception('Batch groups "%s" and "%s" write atlases to the same files "%s"' % \
+                            (outputs[output], group['name'], os.path.join(group['outputDirectory'], group['outputName'])))
+        outputs[output] = group['name']
+
+def estimateGroupMemory(group):
+    '''
+    Оценка пикового расхода памяти на сборку группы в байтах. Размеры изображений читаются
+    из заголовков файлов без декодирования. Учитываются декодированные изображения (все или, при
+    lazyLoad, самое большое) и текстуры атласов, одновременно находящиеся в памяти при записи.
+    '''
+    spriteBytes = [0]
+    for imageName, imagePath in findImages(group['directory']):
+        try:
+            width, height = Image.open(imagePath).size
+        except IOError:
+            continue
+        spriteBytes.append(width * height * 4)
+    images = group['lazyLoad'] and max(spriteBytes) or sum(spriteBytes)
+    if group['bandHeight']:
+        textures = group['maxWidth'] * group['bandHeight'] * 4
+    else:
+        textures = group['maxWidth'] * group['maxHeight'] * 4 * (2 * group['writeJobs'] + 1)
+    return BASE_MEMORY + images + textures
+
+def buildGroup(group):
+    '''
+    Сборка атласов группы (выполняется в дочернем процессе).
+    Возвращает словарь с ключами name, error (None или описание ошибки), atlases, images,
+    seconds, peakMemoryKB.
+    '''
+    startTime = time.time()
+    result = {'name': group['name'], 'error': None, 'atlases': 0, 'images': 0}
+    try:
+        checkGroup(group)
+        scales = group['scales'] is not None and parseScales(group['scales']) or None
+        atlasManager = AtlasManager(group['directory'], group['maxWidth'], group['maxHeight'], group['skipDimensionSum'],
+                                    group['alphaThreshold'], group['dontOptimize'], packingPadding(group['padding'], scales or [1]),
+                                    None, group['lazyLoad'])
+        atlasManager.appendImages(findImages(group['directory']))
+        if atlasManager.count == 0:
+            raise Exception('No images found')
+
+        strategy = {'sortOn': group['sortOn'], 'packer': group['packer'], 'heuristic': group['heuristic']}
+        if group['search']:
+            strategy = atlasManager.searchPackingStrategy(group['sortOn'], group['packer'], group['heuristic'], 1,
+                                                          group['searchTime'], group['allowRotation'],
+                                                          scales is not None and MAXRECTS_PACKERS or None)
+
+        # Каталог может создаваться одновременно несколькими группами.
+        try:
+            os.makedirs(group['outputDirectory'])
+        except OSError:
+            if not os.path.isdir(group['outputDirectory']):
+                raise
+        basePath = os.path.join(group['outputDirectory'], group['outputName'])
+        manifest = group['incremental'] and BuildManifest(basePath + '.manifest') or None
+        textureFormat = TextureFormat(group['pixelFormat'], group['dither'], group['textureContainer'])
+        result['atlases'] = atlasManager.generateAtlases(basePath + ATLAS_INDEX_SEPARATOR, writer=group['format'], manifest=manifest,
+                                                         writeJobs=group['writeJobs'], bandHeight=group['bandHeight'] or None,
+                                                         sizing=group['sizing'], allowRotation=group['allowRotation'],
+                                                         textureFormat=textureFormat, scales=scales, **strategy)
+        result['images'] = atlasManager.count
+    except Exception, e:
+        result['error'] = str(e) or e.__class__.__name__
+    result['seconds'] = time.time() - startTime
+    result['peakMemoryKB'] = peakMemoryKB()
+    return result
+
+def buildGroupProcess(group, connection):
+    '''Сборка группы в дочернем процессе: результат (см. buildGroup) передается через соединение.'''
+    connection.send(buildGroup(group))
+    connection.close()
+
+def runBatch(groups, workers=1, memoryLimit=None, logFile=None):
+    '''
+    Сборка атласов групп в дочерних процессах (каждая группа - в новом процессе, чтобы память
+    освобождалась после сборки группы). Если процесс завершился, не передав результат (например,
+    был завершен системой при нехватке памяти), сборка группы считается неудачной.
+        groups       список словарей параметров групп (см. loadBatchConfig).
+        workers      количество одновременно работающих процессов.
+        memoryLimit  ограничение суммарной оценки расхода памяти одновременно собираемых групп в байтах
+                     (см. estimateGroupMemory); группа, превышающая ограничение, собирается одна.
+        logFile      файл для вывода хода сборки.
+    Возвращает список результатов (см. buildGroup) в порядке групп.
+    '''
+    assert workers > 0, 'Workers count must be positive'
+    if logFile is None:
+        class DummyLog:
+            def write(*args):
+                pass
+        logFile = DummyLog()
+
+    estimates = [memoryLimit and estimateGroupMemory(group) or 0 for group in groups]
+    results = [None] * len(groups)
+    pending = range(len(groups))
+    # Номер группы -> tuple (процесс, соединение для получения результата, оценка расхода памяти, время запуска).
+    running = {}
+    try:
+        while pending or running:
+            # Запускаем группы, помещающиеся в ограничение памяти, в порядке следования.
+            for index in list(pending):
+                if len(running) >= workers:
+                    break
+                if memoryLimit and running and sum(item[2] for item in running.itervalues()) + estimates[index] > memoryLimit:
+                    continue
+                pending.remove(index)
+                receiver, sender = multiprocessing.Pipe(False)
+                process = multiprocessing.Process(target=buildGroupProcess, args=(groups[index], sender))
+                process.daemon = True
+                process.start()
+                sender.close()
+                running[index] = (process, receiver, estimates[index], time.time())
+
+            # Ожидание с таймаутом, чтобы оставаться прерываемым по Ctrl+C.
+            finished = []
+            while not finished:
+                for index, (process, receiver, estimate, startTime) in running.iteritems():
+                    if receiver.poll(0.1):
+                        try:
+                            finished.append((index, receiver.recv()))
+                        except EOFError:
+                            # Процесс завершился, не передав результат.
+                            process.join()
+                            finished.append((index, failedResult(groups[index], process.exitcode, time.time() - startTime)))
+
+            for index, result in finished:
+                process, receiver, estimate, startTime = running.pop(index)
+                process.join()
+                receiver.close()
+                results[index] = result
+                print >> logFile, '[Batch] %s "%s" (%d of %d)' % (result['error'] is None and 'built' or 'FAILED', result['name'],
+                                                                 len(groups) - len(pending) - len(running), len(groups))
+    finally:
+        for process, receiver, estimate, startTime in running.itervalues():
+            process.terminate()
+            process.join()
+    return results
+
+def failedResult(group, exitCode, seconds):
+    '''Результат сборки группы, процесс которой завершился, не передав результат.'''
+    return {'name': group['name'], 'error': 'Build process exited with code %s' % exitCode, 'atlases': 0, 'images': 0,
+            'seconds': seconds, 'peakMemoryKB': None}
+
+def printBatchSummary(results, logFile):
+    '''Вывод итогов пакетной сборки: таблица групп, ошибки и общие показатели.'''
+    nameWidth = max([len(result['name']) for result in results] + [5])
+    print >> logFile, '%-*s %7s %8s %8s %9s %8s' % (nameWidth, 'group', 'status', 'atlases', 'images', 'seconds', 'peak MB')
+    for result in results:
+        peakMemory = result['peakMemoryKB'] is not None and '%.1f' % (result['peakMemoryKB'] / 1024.0) or '-'
+        print >> logFile, '%-*s %7s %8d %8d %9.2f %8s' % (nameWidth, result['name'], result['error'] is None and 'ok' or 'FAILED',
+                                                         result['atlases'], result['images'], result['seconds'], peakMemory)
+    failed = [result for result in results if result['error'] is not None]
+    for result in failed:
+        print >> logFile, '*** Group "%s" failed: %s' % (result['name'], result['error'])
+    print >> logFile, 'total: groups %d, failed %d, atlases %d, images %d' % \
+                      (len(results), len(failed), sum(result['atlases'] for result in results),
+                       sum(result['images'] for result in results))
@@ -0,0 +1,206 @@
+# coding: utf-8
+'''
+Двоичный формат описания атласа, рассчитанный на отображение файла в память (mmap) и поиск
+кадров без разбора. Все числа записываются в little-endian, все блоки выровнены на 4 байта.
+
+    Заголовок (HEADER, 32 байта):
+        magic           'ATLB'.
+        version         версия формата (VERSION).
+        flags           FLAG_ROTATED - в атласе есть повернутые кадры,
+                        FLAG_KTX_TEXTURE - текстура записана в KTX, иначе в PNG.
+        pixelFormat     номер формата пикселей текстуры в PIXEL_FORMATS.
+        frameCount      количество кадров.
+        atlasWidth      ширина текстуры атласа.
+        atlasHeight     высота текстуры атласа.
+        framesOffset    смещение массива кадров от начала файла.
+        indexOffset     смещение хеш-индекса от начала файла.
+        stringsOffset   смещение таблицы имен от начала файла.
+
+    Кадр (FRAME, 28 байт, по одному на изображение, включая дубликаты):
+        x, y            положение (обрезанного) изображения в атласе.
+        width, height   размер (обрезанного) изображения до поворота.
+        sourceX,
+        sourceY         положение обрезанного региона в исходном изображении.
+        originalWidth,
+        originalHeight  исходный размер изображения.
+        flags           FLAG_ROTATED - изображение повернуто на 90 градусов по часовой стрелке.
+        nameLength      длина имени в байтах (UTF-8, без завершающего нуля).
+        nameOffset      смещение имени от начала таблицы имен.
+        nameHash        хеш имени (nameHash).
+
+    Хеш-индекс (INDEX_ENTRY, 8 байт на кадр): пары (хеш имени, номер кадра), отсортированные
+    по хешу и номеру кадра. Кадр ищется двоичным поиском по хешу со сравнением имен.
+
+    Таблица имен: имена кадров в UTF-8, каждое завершается нулевым байтом.
+'''
+
+import mmap
+import struct
+import collections
+from pixelformat import PIXEL_FORMATS
+
+MAGIC = 'ATLB'
+VERSION = 1
+FLAG_ROTATED = 1
+FLAG_KTX_TEXTURE = 2
+
+HEADER = struct.Struct('<4sHBBIIIIII')
+FRAME = struct.Struct('<10HII')
+INDEX_ENTRY = struct.Struct('<II')
+
+# Наибольшее значение координат и размеров в записи кадра.
+MAX_COORDINATE = 0xffff
+
+# Наибольшая длина имени кадра в байтах (UTF-8).
+MAX_NAME_LENGTH = 0xffff
+
+# Кадр атласа, прочитанный из двоичного описания.
+BinaryAtlasFrame = collections.namedtuple('BinaryAtlasFrame', 'name x y width height sourceX sourceY '
+                                                              'originalWidth originalHeight rotated')
+
+def nameHash(name):
+    '''Хеш FNV-1a (32 бита) от имени кадра в UTF-8.'''
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    value = 0x811c9dc5
+    for char in name:
+        value = ((value ^ ord(char)) * 0x01000193) & 0xffffffff
+    return value
+
+def packBinaryAtlas(atlasSize, frames, textureFormat=None):
+    '''
+    Формирование двоичного описания атласа.
+        atlasSize      tuple (ширина, высота) текстуры атласа.
+        frames         список tuple (имя, x, y, ширина, высота, sourceX, sourceY, исходная ширина,
+                       исходная высота, повернуто ли изображение).
+        textureFormat  формат записи текстуры (TextureFormat), по умолчанию RGBA8888 PNG.
+    Возвращает строку с содержимым файла. Возбуждает исключение, если геометрия или имя кадра
+    не помещаются в поля записи кадра.
+    '''
+    strings = []
+    stringsSize = 0
+    records = []
+    index = []
+    hasRotation = False
+    for frameIndex, frame in enumerate(frames):
+        name, geometry, rotated = frame[0], frame[1:9], frame[9]
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        if max(geometry) > MAX_COORDINATE or min(geometry) < 0:
+            raise Exception('Frame "%s" geometry does not fit binary atlas format' % name)
+        if len(name) > MAX_NAME_LENGTH:
+            raise Exception('Frame "%s" name is too long for binary atlas format' % name)
+        hashValue = nameHash(name)
+        records.append(FRAME.pack(*(geometry + (rotated and FLAG_ROTATED or 0, len(name), stringsSize, hashValue))))
+        index.append((hashValue, frameIndex))
+        strings.append(name + '\0')
+        stringsSize += len(name) + 1
+        hasRotation = hasRotation or rotated
+    index.sort()
+
+    framesOffset = HEADER.size
+    indexOffset = framesOffset + FRAME.size * len(records)
+    stringsOffset = indexOffset + INDEX_ENTRY.size * len(index)
+    padding = '\0' * (-stringsSize % 4)
+    flags = hasRotation and FLAG_ROTATED or 0
+    pixelFormat = 0
+    if textureFormat is not None:
+        flags |= textureFormat.extension == '.ktx' and FLAG_KTX_TEXTURE or 0
+        pixelFormat = PIXEL_FORMATS.index(textureFormat.pixelFormat)
+    header = HEADER.pack(MAGIC, VERSION, flags, pixelFormat, len(records), atlasSize[0], atlasSize[1],
+                         framesOffset, indexOffset, stringsOffset)
+    return ''.join([header] + records + [INDEX_ENTRY.pack(*entry) for entry in index] + strings + [padding])
+
+
+class BinaryAtlasReader(object):
+    '''
+    Чтение двоичного описания атласа (см. BinaryWriter). Файл отображается в память, кадры
+    декодируются только при обращении к ним.
+    '''
+
+    def __init__(self, fileName):
+        '''Инициализация. Возбуждает исключение, если файл не является описанием атласа.'''
+        self.__file = open(fileName, 'rb')
+        try:
+            self.__data = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self.__file.close()
+            raise
+        if len(self.__data) < HEADER.size:
+            self.close()
+            raise Exception('File is too small for binary atlas: "%s"' % fileName)
+        magic, version, self.__flags, self.__pixelFormat, self.__frameCount, width, height, self.__framesOffset, self.__indexOffset, \
+            self.__stringsOffset = HEADER.unpack_from(self.__data, 0)
+        if magic != MAGIC or version != VERSION or self.__pixelFormat >= len(PIXEL_FORMATS):
+            self.close()
+            raise Exception('Unsupported binary atlas format: "%s"' % fileName)
+        self.__atlasSize = (width, height)
+
+    @property
+    def atlasSize(self):
+        '''Размер текстуры атласа в виде tuple (ширина, высота).'''
+        return self.__atlasSize
+
+    @property
+    def hasRotation(self):
+        '''Есть ли в атласе повернутые кадры.'''
+        return bool(self.__flags & FLAG_ROTATED)
+
+    @property
+    def pixelFormat(self):
+        '''Формат пикселей текстуры (см. PIXEL_FORMATS).'''
+        return PIXEL_FORMATS[self.__pixelFormat]
+
+    @property
+    def ktxTexture(self):
+        '''Записана ли текстура в KTX (иначе в PNG).'''
+        return bool(self.__flags & FLAG_KTX_TEXTURE)
+
+    def __len__(self):
+        '''Количество кадров.'''
+        return self.__frameCount
+
+    def frame(self, frameIndex):
+        '''Кадр с заданным номером (BinaryAtlasFrame).'''
+        assert 0 <= frameIndex < self.__frameCount, 'Frame index out of range'
+        record = FRAME.unpack_from(self.__data, self.__framesOffset + FRAME.size * frameIndex)
+        nameLength, nameOffset = record[9], record[10]
+        start = self.__stringsOffset + nameOffset
+        name = self.__data[start:start + nameLength].decode('utf-8')
+        return BinaryAtlasFrame(name, *(record[:8] + (bool(record[8] & FLAG_ROTATED),)))
+
+    def frames(self):
+        '''Список всех кадров в порядке записи.'''
+        return [self.frame(frameIndex) for frameIndex in xrange(self.__frameCount)]
+
+    def find(self, name):
+        '''Поиск кадра по имени двоичным поиском в хеш-индексе. Возвращает BinaryAtlasFrame или None.'''
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        hashValue = nameHash(name)
+
+        # Первая запись индекса с заданным хешем.
+        low, high = 0, self.__frameCount
+        while low < high:
+            middle = (low + high) / 2
+            if INDEX_ENTRY.unpack_from(self.__data, self.__indexOffset + INDEX_ENTRY.size * middle)[0] < hashValue:
+                low = middle + 1
+            else:
+                high = middle
+
+        # Среди записей с одинаковым хешем сравниваем имена.
+        while low < self.__frameCount:
+            entryHash, frameIndex = INDEX_ENTRY.unpack_from(self.__data, self.__indexOffset + INDEX_ENTRY.size * low)
+            if entryHash != hashValue:
+                break
+            nameLength, nameOffset = FRAME.unpack_from(self.__data, self.__framesOffset + FRAME.size * frameIndex)[9:11]
+            start = self.__stringsOffset + nameOffset
+            if nameLength == len(name) and self.__data[start:start + nameLength] == name:
+                return self.frame(frameIndex)
+            low += 1
+        return None
+
+    def close(self):
+        '''Освобождение отображения файла.'''
+        self.__data.close()
+        self.__file.close()
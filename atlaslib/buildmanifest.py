@@ -0,0 +1,113 @@
+# coding: utf-8
+import os
+import json
+
+class BuildManifest(object):
+    '''
+    Манифест сборки атласов.
+    Хранит параметры сборки и для каждого атласа список попавших в него изображений
+    (путь, имя, контрольная сумма и положение в атласе). Используется для инкрементальной
+    сборки: атласы, изображения которых не изменились, не перепаковываются и не перезаписываются.
+    '''
+
+    # Версия формата манифеста. Манифест с другой версией игнорируется.
+    VERSION = 2
+
+    def __init__(self, path, logFile=None):
+        '''
+        Инициализация и загрузка манифеста.
+            path        путь к файлу манифеста.
+            logFile     файл для вывода отладочной информации.
+        '''
+        if logFile is None:
+            class DummyLog:
+                def write(*args):
+                    pass
+            logFile = DummyLog()
+
+        self.__path = path
+        self.__log = logFile
+        self.__options = None
+        self.__atlases = {}
+        self.__load()
+
+    @property
+    def path(self):
+        '''Путь к файлу манифеста.'''
+        return self.__path
+
+    @property
+    def options(self):
+        '''Параметры предыдущей сборки (словарь) или None.'''
+        return self.__options
+
+    @property
+    def atlases(self):
+        '''
+        Словарь атласов: индекс атласа -> список записей об изображениях
+        (короткий путь, имя, контрольная сумма, x, y).
+        '''
+        return self.__atlases
+
+    def reset(self, options, keptIndices):
+        '''
+        Начало новой сборки.
+            options      параметры новой сборки.
+            keptIndices  индексы атласов, сохраняемых без изменений.
+        '''
+        self.__options = options
+        self.__atlases = dict((index, self.__atlases[index]) for index in keptIndices)
+
+    def addAtlas(self, atlasIndex, atlas):
+        '''
+        Запись информации о собранном атласе.
+            atlasIndex  индекс атласа.
+            atlas       объект Atlas.
+        '''
+        self.__atlases[atlasIndex] = [(image.shortPath, image.name, image.checksum,
+                                       image.atlasPosition.x, image.atlasPosition.y) for image in atlas.images]
+
+    def save(self):
+        '''Запись манифеста на диск.'''
+        atlases = [{'index': index, 'images': [list(record) for record in records]}
+                   for index, records in sorted(self.__atlases.iteritems())]
+        manifestFile = open(self.__path, 'wt')
+        try:
+            json.dump({'version': self.VERSION, 'options': self.__options, 'atlases': atlases},
+                      manifestFile, indent=1, sort_keys=True)
+        finally:
+            manifestFile.close()
+
+    #
+    # Приватные методы.
+    #
+
+    def __load(self):
+        '''Загрузка манифеста с диска. Поврежденный или устаревший манифест игнорируется.'''
+        if not os.path.exists(self.__path):
+            return
+        try:
+            manifestFile = open(self.__path, 'rt')
+            try:
+                data = json.load(manifestFile)
+            finally:
+                manifestFile.close()
+            if data['version'] != self.VERSION:
+                raise ValueError('unsupported manifest version')
+            options = dict((self.__str(key), self.__str(value)) for key, value in data['options'].iteritems())
+            atlases = {}
+            for atlas in data['atlases']:
+                atlases[int(atlas['index'])] = [(self.__str(path), self.__str(name), self.__str(checksum), int(x), int(y))
+                                                for path, name, checksum, x, y in atlas['images']]
+        except Exception, e:
+            print >> self.__log, '[BuildManifest] ignoring manifest "%s": %s' % (self.__path, e)
+            return
+        self.__options = options
+        self.__atlases = atlases
+        print >> self.__log, '[BuildManifest] loaded "%s" (atlases %d)' % (self.__path, len(self.__atlases))
+
+    def __str(self, value):
+        '''Приведение строк, прочитанных из json, к типу str.'''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
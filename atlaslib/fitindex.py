@@ -0,0 +1,91 @@
+# coding: utf-8
+from bisect import bisect_right, insort
+from util import Size
+
+class FittableImageIndex(object):
+    '''
+    Индекс изображений для поиска наибольшего изображения, помещающегося в заданную область.
+    Изображения группируются по размеру вдоль параметра сортировки, а внутри группы - по второму
+    размеру, поэтому поиск и удаление не требуют просмотра всего списка изображений.
+    '''
+
+    def __init__(self, images, sortOn):
+        '''
+        Инициализация.
+            images   список изображений, отсортированный по возрастанию параметра сортировки.
+            sortOn   параметр сортировки (ширина или высота).
+        '''
+        assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
+        self.__sortOn = sortOn
+        self.__count = 0
+
+        # Отсортированный список значений параметра сортировки и группы изображений:
+        # значение параметра -> (отсортированный список значений второго размера,
+        #                        второй размер -> список пар (позиция в исходном списке, изображение)).
+        self.__keys = []
+        self.__buckets = {}
+        for position, image in enumerate(images):
+            key, otherKey = self.__imageKeys(image.sourceRect.size)
+            if key not in self.__buckets:
+                assert not self.__keys or self.__keys[-1] < key, 'Images must be sorted on %s' % sortOn
+                self.__keys.append(key)
+                self.__buckets[key] = ([], {})
+            otherKeys, groups = self.__buckets[key]
+            if otherKey not in groups:
+                insort(otherKeys, otherKey)
+                groups[otherKey] = []
+            groups[otherKey].append((position, image))
+            self.__count += 1
+
+    def __len__(self):
+        '''Количество оставшихся изображений.'''
+        return self.__count
+
+    def retainMostFittableImage(self, targetSize):
+        '''
+        Возвращает изображение, помещающееся в заданный регион и последнее в исходном списке среди
+        таких изображений, и удаляет его из индекса. Если изображение не найдено, возвращает None.
+        '''
+        assert isinstance(targetSize, Size), 'Size must be Size instance'
+        return self.retainFittableImage(targetSize.width, targetSize.height)
+
+    def retainFittableImage(self, width, height):
+        '''То же, что и retainMostFittableImage, но размер региона задается числами (для цикла размещения).'''
+        if self.__sortOn == 'height':
+            keyLimit, otherKeyLimit = height, width
+        else:
+            keyLimit, otherKeyLimit = width, height
+
+        # Позиции изображений возрастают вместе с параметром сортировки, поэтому достаточно найти
+        # первую с конца группу, в которой есть подходящее изображение.
+        keyIndex = bisect_right(self.__keys, keyLimit)
+        while keyIndex > 0:
+            keyIndex -= 1
+            key = self.__keys[keyIndex]
+            otherKeys, groups = self.__buckets[key]
+            if otherKeys[0] > otherKeyLimit:
+                continue
+
+            # Среди подгрупп с подходящим вторым размером выбираем изображение с наибольшей позицией.
+            otherKey = max(otherKeys[:bisect_right(otherKeys, otherKeyLimit)], key=lambda k: groups[k][-1][0])
+            group = groups[otherKey]
+            position, image = group.pop()
+            if not group:
+                del groups[otherKey]
+                otherKeys.remove(otherKey)
+                if not otherKeys:
+                    del self.__buckets[key]
+                    del self.__keys[keyIndex]
+            self.__count -= 1
+            return image
+        return None
+
+    #
+    # Приватные методы.
+    #
+
+    def __imageKeys(self, size):
+        '''Возвращает tuple (размер вдоль параметра сортировки, второй размер).'''
+        if self.__sortOn == 'height':
+            return size.height, size.width
+        return size.width, size.height
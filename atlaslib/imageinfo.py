@@ -2,17 +2,27 @@
 import os
 import hashlib
 from PIL import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from util import *
+from metrics import BuildMetrics, NULL_METRICS
 
 class AtlasImageInfo(object):
     '''Информация об изображении в атласе'''
     
-    def __init__(self, imageName, imagePath, imageShortPath, alphaThreshold, padding):
+    def __init__(self, imageName, imagePath, imageShortPath, alphaThreshold, padding, lazyLoad=False, metadata=None,
+                 metrics=None):
         '''
         Инициализация.
             imageName    имя изображения в атласе.
             imagePath    путь к изображению.
             padding     размер пустого пространства между соседними изображениями.
+            lazyLoad     не хранить декодированное изображение до размещения в атласе.
+            metadata     заранее вычисленные метаданные изображения (см. свойство metadata),
+                         при их наличии изображение не загружается.
+            metrics      объект для сбора метрик (см. BuildMetrics).
         '''
         assert imageName, 'Invalid image name'
         assert os.path.exists(imagePath), 'Image cannot be found: "%s"' % imagePath
@@ -26,7 +36,21 @@ class AtlasImageInfo(object):
         self.__padding = padding
         self.__image = None
         self.__placed = False
-        self.__loadImage(imagePath, True)
+        self.__rotated = False
+        self.__metrics = metrics or NULL_METRICS
+        if metadata is not None:
+            originalSize, sourceRect, self.__checksum = metadata
+            self.__originalSize = Size(*originalSize)
+            self.__sourceRect = Rect(Point(*sourceRect[:2]), Size(sourceRect[2] - sourceRect[0], sourceRect[3] - sourceRect[1]))
+        else:
+            self.__loadImage(imagePath, True)
+
+            # В ленивом режиме храним только геометрию изображения, а пиксели повторно
+            # декодируем при копировании в атлас.
+            if lazyLoad:
+                self.__image = None
+        self.__paddedSourceRect = Rect(self.__sourceRect.origin, Size(self.__sourceRect.size.width + self.__padding,
+                                                                      self.__sourceRect.size.height + self.__padding))
     
     @property
     def name(self):
@@ -60,40 +84,81 @@ class AtlasImageInfo(object):
 
     @property
     def checksum(self):
-        '''md5 от данных изображения'''
-        if self.__checksum is None:
-            self.__checksum = hashlib.md5(open(self.__path, 'rb').read()).hexdigest()
+        '''md5 от пикселей (обрезанного) изображения в формате RGBA.'''
         return self.__checksum
     
+    @property
+    def metadata(self):
+        '''
+        Метаданные изображения, не требующие хранения пикселей: tuple из исходного размера,
+        координат сохраняемого региона и контрольной суммы.
+        '''
+        return (self.__originalSize.sizeTuple, self.__sourceRect.coordinateTuple, self.__checksum)
+
     @property
     def atlasPosition(self):
         '''Координата верхнего левого угла (обрезанного) изображения в атласе.'''
         assert self.__placed, 'Image was not placed in atlas'
         return self.__atlasPosition
+
+    @property
+    def rotated(self):
+        '''Повернуто ли изображение в атласе на 90 градусов по часовой стрелке.'''
+        assert self.__placed, 'Image was not placed in atlas'
+        return self.__rotated
+
+    @property
+    def atlasRect(self):
+        '''Регион атласа, занятый (обрезанным) изображением с учетом поворота.'''
+        assert self.__placed, 'Image was not placed in atlas'
+        width, height = self.__sourceRect.size.sizeTuple
+        if self.__rotated:
+            width, height = height, width
+        return Rect(self.__atlasPosition, Size(width, height))
     
-    def placeToAtlasImage(self, image, position, isDuplicate=False):
+    def placeToAtlasImage(self, image, position, isDuplicate=False, rotated=False):
         '''
         Копирование (обрезанного) изображения в атлас и освобождение памяти под изображение.
-            image          объект Image, в который копируется изображение
+        Если изображение не хранится в памяти, оно повторно загружается с диска.
+            image          объект Image или массив NumPy (высота x ширина x 4) байт RGBA, в который копируется
+                           изображение; None, если атлас записывается полосами и пиксели будут получены
+                           позже (см. trimmedImage).
             atlasPosition  положение верхнего левого угла (обрезанного) изображения в атласе.
             isDuplicate    данное изображение уже есть в атласе
+            rotated        изображение размещается повернутым на 90 градусов по часовой стрелке.
         '''
         assert isDuplicate or not self.__placed, 'Image already placed in atlas'
-        assert isinstance(image, Image.Image), 'Image must be Image instance'
+        assert image is None or isinstance(image, Image.Image) or (numpy is not None and isinstance(image, numpy.ndarray)), \
+               'Image must be Image instance or NumPy array'
         assert isinstance(position, Point), 'AtlasPosition must be Point instance'
-        assert isDuplicate or self.__image is not None, 'Image not loaded'
         
-        if not isDuplicate:
-            atlasImage = self.__image.crop(self.__sourceRect.coordinateTuple)
-            image.paste(atlasImage, position.pointTuple)
+        self.__rotated = rotated
+        if image is not None and not isDuplicate:
+            with self.__metrics.measure('paste'):
+                if isinstance(image, Image.Image):
+                    image.paste(self.__cropSourceRect(), position.pointTuple)
+                else:
+                    self.__copySourceRect(image, position)
         self.__atlasPosition = position
         self.__placed = True
+        if image is not None:
+            self.__image = None
+
+    def resetPlacement(self):
+        '''Сброс размещения в атласе перед повторной сборкой атласов.'''
+        self.__placed = False
+        self.__rotated = False
+
+    def trimmedImage(self):
+        '''
+        Возвращает сохраняемый в атлас регион размещенного изображения (объект Image, с учетом поворота) и освобождает
+        память под декодированное изображение. Используется при записи атласа полосами.
+        '''
+        assert self.__placed, 'Image was not placed in atlas'
+        image = self.__cropSourceRect()
         self.__image = None
+        return image
 
-    def isEqual(self, imageInfo):
-        '''Сравнение двух изображений'''
-        return self.checksum == imageInfo.checksum
-    
     #
     # Приватные методы.
     #
@@ -106,64 +171,174 @@ class AtlasImageInfo(object):
         '''
         assert self.__image is None, 'Image already loaded'
         assert not self.__placed, 'Image already placed in atlas'
-        self.__image = Image.open(imagePath)
-        self.__image.convert('RGBA')
+        self.__image = self.__openImage(imagePath)
         self.__originalSize = Size(*self.__image.size)
         if self.__originalSize.width <= 0 or self.__originalSize.height <= 0:
             raise Exception('Image "%s": invalid dimensions (%d x %d)' % \
                              (self.name, self.__originalSize.width, self.__originalSize.height))
         self.__sourceRect = Rect(Point(0, 0), self.__originalSize)
         if trim:
-            self.__trim()
-      	self.__paddedSourceRect = Rect(self.__sourceRect.origin, Size(self.__sourceRect.size.width + self.__padding,
-	                                                                  self.__sourceRect.size.height + self.__padding))
+            with self.__metrics.measure('trim'):
+                self.__trim()
+
+        # Контрольную сумму считаем по пикселям сохраняемого региона, а не по данным файла, чтобы
+        # совпадали одинаковые изображения, сохраненные разными кодировщиками.
+        with self.__metrics.measure('checksum'):
+            checksum = hashlib.md5('%s:' % self.__sourceRect.size)
+            checksum.update(self.__image.crop(self.__sourceRect.coordinateTuple).tobytes())
+            self.__checksum = checksum.hexdigest()
     
+    def __cropSourceRect(self):
+        '''Вырезание сохраняемого региона; если изображение не хранится в памяти, оно загружается с диска.'''
+        sourceImage = self.__image if self.__image is not None else self.__openImage(self.__path)
+        image = sourceImage.crop(self.__sourceRect.coordinateTuple)
+        if self.__rotated:
+            image = image.transpose(Image.ROTATE_270)
+        return image
+
+    def __copySourceRect(self, pixels, position):
+        '''
+        Копирование сохраняемого региона в срез массива текстуры атласа; если изображение не хранится в памяти,
+        оно загружается с диска. В массив преобразуется только сохраняемый регион, а не все изображение
+        с прозрачными краями.
+        '''
+        sourceImage = self.__image if self.__image is not None else self.__openImage(self.__path)
+        width, height = self.__sourceRect.size.sizeTuple
+        if (width, height) != sourceImage.size:
+            sourceImage = sourceImage.crop(self.__sourceRect.coordinateTuple)
+        region = numpy.frombuffer(sourceImage.tobytes(), numpy.uint8).reshape(height, width, 4)
+        if self.__rotated:
+            region = numpy.rot90(region, -1)
+        height, width = region.shape[:2]
+        pixels[position.y:position.y + height, position.x:position.x + width] = region
+
+    def __openImage(self, imagePath):
+        '''Открытие изображения и приведение его к формату RGBA.'''
+        with self.__metrics.measure('decode'):
+            image = Image.open(imagePath)
+            if image.mode != 'RGBA':
+                image = image.convert('RGBA')
+            # Декодируем сразу, чтобы время декодирования не попадало в следующие фазы.
+            image.load()
+        self.__metrics.addCount('bytesRead', os.path.getsize(imagePath))
+        return image
+
     def __trim(self):
         '''
         Обрезание прозрачных краев изображения.
             alphaThreshold  пороговое значение прозрачности для обрезания краев.
         '''
         assert self.__image is not None, 'Image is not loaded'
-        if self.__image.mode != 'RGBA':
-            self.__image = self.__image.convert('RGBA')
         alphaThreshold = self.__alphaThreshold
-        originalWidth, originalHeight = self.__originalSize.sizeTuple
-        
-        # Ищем левую границу.
-        minX = self.__findBorder(xrange(originalWidth), 1,
-                                 xrange(originalHeight), originalWidth, alphaThreshold)
-        
+
+        # Бинаризуем альфа-канал по пороговому значению и ищем границы непрозрачной области
+        # сразу по всему изображению.
+        alpha = self.__image.getchannel('A')
+        bbox = alpha.point([0] * alphaThreshold + [255] * (256 - alphaThreshold)).getbbox()
+
         # Изображение полностью прозрачно.
-        if minX is None:
-            minX = maxX = 0
-            minY = maxY = 0
-        else:
-            # Ищем остальные границы.
-            maxX = self.__findBorder(xrange(originalWidth - 1, -1, -1), 1,
-                                     xrange(originalHeight), originalWidth, alphaThreshold)
-            minY = self.__findBorder(xrange(originalHeight), originalWidth,
-                                     xrange(originalWidth), 1, alphaThreshold)
-            maxY = self.__findBorder(xrange(originalHeight - 1, -1, -1), originalWidth,
-                                     xrange(originalWidth), 1, alphaThreshold)
+        if bbox is None:
+            bbox = (0, 0, 1, 1)
+
         # Обновляем размер сохраняемой области изображения.
-        self.__sourceRect = Rect(Point(minX, minY), Size(maxX - minX + 1, maxY - minY + 1))
-        
-    
-    def __findBorder(self, firstRange, firstStride, secondRange, secondStride, alphaThreshold):
+        minX, minY, maxX, maxY = bbox
+        self.__sourceRect = Rect(Point(minX, minY), Size(maxX - minX, maxY - minY))
+
+
+class ScaledImageInfo(object):
+    '''
+    Информация об изображении в уменьшенной копии атласа (см. Atlas.scaled): геометрия размещенного
+    изображения, умноженная на масштаб. Округляются координаты углов занятого изображением региона атласа,
+    поэтому изображения, не пересекавшиеся в исходном атласе, не пересекаются и в уменьшенном.
+    Размер изображения при этом отличается от точного не больше чем на пиксель (и не меньше 1).
+    Имя и пути совпадают с исходным изображением.
+    '''
+
+    def __init__(self, imageInfo, scale, atlasSize):
         '''
-        Сканирование изображения в заданном направлении в поисках полосы непрозрачности.
+        Инициализация.
+            imageInfo   размещенное в атласе изображение (AtlasImageInfo).
+            scale       масштаб (0 < scale <= 1).
+            atlasSize   размер уменьшенного атласа.
         '''
-        assert firstStride > 0 and secondStride > 0, 'Stride must be positive'
-        originalWidth, originalHeight = self.__originalSize.sizeTuple
-        data = self.__image.getdata()
-        
-        extremum = None
-        for i in firstRange:
-            for j in secondRange:
-                alpha = data[i * firstStride + j * secondStride][3]
-                if alpha >= alphaThreshold:
-                    extremum = i
-                    break
-            if extremum is not None:
-                break
-        return extremum
+        assert isinstance(imageInfo, AtlasImageInfo), 'ImageInfo must be AtlasImageInfo instance'
+        assert 0 < scale <= 1, 'Scale must be in range (0, 1]'
+        scaled = lambda value: int(value * scale + 0.5)
+        self.__imageInfo = imageInfo
+
+        # Регион атласа: изображение, меньшее пикселя после уменьшения, занимает один пиксель.
+        minX, minY, maxX, maxY = map(scaled, imageInfo.atlasRect.coordinateTuple)
+        minX, minY = min(minX, atlasSize.width - 1), min(minY, atlasSize.height - 1)
+        self.__atlasPosition = Point(minX, minY)
+        width, height = max(1, maxX - minX), max(1, maxY - minY)
+        if imageInfo.rotated:
+            width, height = height, width
+
+        # Обрезанный регион не должен выходить за границы уменьшенного исходного изображения.
+        self.__originalSize = Size(*[max(length, scaled(originalLength)) for length, originalLength
+                                     in zip((width, height), imageInfo.originalSize.sizeTuple)])
+        sourceX, sourceY = imageInfo.sourceRect.origin.pointTuple
+        origin = Point(min(scaled(sourceX), self.__originalSize.width - width),
+                       min(scaled(sourceY), self.__originalSize.height - height))
+        self.__sourceRect = Rect(origin, Size(width, height))
+
+    @property
+    def name(self):
+        '''Имя изображения в атласе.'''
+        return self.__imageInfo.name
+
+    @property
+    def shortPath(self):
+        '''Короткий путь к файлу изображения.'''
+        return self.__imageInfo.shortPath
+
+    @property
+    def path(self):
+        '''Путь к файлу изображения.'''
+        return self.__imageInfo.path
+
+    @property
+    def checksum(self):
+        '''Контрольная сумма исходного изображения.'''
+        return self.__imageInfo.checksum
+
+    @property
+    def originalSize(self):
+        '''Уменьшенный исходный размер изображения.'''
+        return self.__originalSize
+
+    @property
+    def sourceRect(self):
+        '''Уменьшенный регион изображения, сохраняемый в атлас.'''
+        return self.__sourceRect
+
+    @property
+    def atlasPosition(self):
+        '''Координата верхнего левого угла (обрезанного) изображения в уменьшенном атласе.'''
+        return self.__atlasPosition
+
+    @property
+    def rotated(self):
+        '''Повернуто ли изображение в атласе на 90 градусов по часовой стрелке.'''
+        return self.__imageInfo.rotated
+
+    @property
+    def atlasRect(self):
+        '''Регион уменьшенного атласа, занятый (обрезанным) изображением с учетом поворота.'''
+        width, height = self.__sourceRect.size.sizeTuple
+        if self.rotated:
+            width, height = height, width
+        return Rect(self.__atlasPosition, Size(width, height))
+
+
+def readImageMetadata(args):
+    '''
+    Вычисление метаданных изображения по tuple (путь к изображению, пороговое значение прозрачности,
+    собирать ли метрики). Функция используется для параллельной загрузки изображений в дочерних процессах.
+    Возвращает tuple (метаданные, метрики загрузки или None; см. BuildMetrics.report).
+    '''
+    imagePath, alphaThreshold, collectMetrics = args
+    metrics = collectMetrics and BuildMetrics() or None
+    metadata = AtlasImageInfo(os.path.basename(imagePath), imagePath, imagePath, alphaThreshold, 0, lazyLoad=True,
+                              metrics=metrics).metadata
+    return metadata, metrics and metrics.report()
@@ -0,0 +1,129 @@
+# coding: utf-8
+import os
+import marshal
+
+class MetadataCache(object):
+    '''
+    Кэш метаданных изображений на диске.
+    Для каждого изображения хранятся исходный размер, сохраняемый в атлас регион и контрольная сумма
+    (см. AtlasImageInfo.metadata). Запись действительна, пока не изменились путь к файлу, время его
+    модификации, размер и пороговое значение прозрачности.
+    Файл кэша сохраняется в формате marshal и не предназначен для загрузки из недоверенных источников.
+    '''
+
+    # Версия формата файла кэша. Кэш с другой версией игнорируется.
+    VERSION = 2
+
+    def __init__(self, path, logFile=None):
+        '''
+        Инициализация и загрузка кэша.
+            path        путь к файлу кэша.
+            logFile     файл для вывода отладочной информации.
+        '''
+        if logFile is None:
+            class DummyLog:
+                def write(*args):
+                    pass
+            logFile = DummyLog()
+
+        self.__path = path
+        self.__log = logFile
+        self.__entries = {}
+        self.__signatures = {}
+        self.__hits = 0
+        self.__misses = 0
+        self.__load()
+
+    @property
+    def path(self):
+        '''Путь к файлу кэша.'''
+        return self.__path
+
+    def get(self, imagePath, alphaThreshold):
+        '''
+        Поиск метаданных изображения в кэше. Если запись не найдена или устарела, возвращает None.
+            imagePath       путь к изображению.
+            alphaThreshold  пороговое значение прозрачности, с которым обрезалось изображение.
+        '''
+        key = os.path.abspath(imagePath)
+        stat = os.stat(imagePath)
+        signature = (stat.st_mtime, stat.st_size, alphaThreshold)
+
+        # Запоминаем состояние файла на момент проверки, чтобы при изменении файла во время
+        # загрузки в кэш не попали метаданные новой версии с сигнатурой старой.
+        self.__signatures[key] = signature
+
+        entry = self.__entries.get(key)
+        metadata = entry is not None and entry[0] == signature and self.__validMetadata(entry[1]) and entry[1] or None
+        if metadata is None:
+            self.__misses += 1
+        else:
+            self.__hits += 1
+        return metadata
+
+    def put(self, imagePath, alphaThreshold, metadata):
+        '''
+        Сохранение метаданных изображения в кэше.
+            imagePath       путь к изображению.
+            alphaThreshold  пороговое значение прозрачности, с которым обрезалось изображение.
+            metadata        метаданные изображения (см. AtlasImageInfo.metadata).
+        '''
+        assert self.__validMetadata(metadata), 'Invalid image metadata'
+        key = os.path.abspath(imagePath)
+        signature = self.__signatures.get(key)
+        if signature is None or signature[2] != alphaThreshold:
+            stat = os.stat(imagePath)
+            signature = (stat.st_mtime, stat.st_size, alphaThreshold)
+        self.__entries[key] = (signature, metadata)
+
+    def save(self):
+        '''Запись кэша на диск. Записи об удаленных файлах отбрасываются.'''
+        entries = dict((key, entry) for key, entry in self.__entries.iteritems() if os.path.exists(key))
+        print >> self.__log, '[MetadataCache] saving "%s" (entries %d, hits %d, misses %d)' % \
+                             (self.__path, len(entries), self.__hits, self.__misses)
+
+        # Пишем во временный файл и подменяем им старый, чтобы прерванная запись не испортила кэш.
+        tempPath = self.__path + '.tmp'
+        cacheFile = open(tempPath, 'wb')
+        try:
+            marshal.dump((self.VERSION, entries), cacheFile, 2)
+        finally:
+            cacheFile.close()
+        if os.name == 'nt' and os.path.exists(self.__path):
+            os.remove(self.__path)
+        os.rename(tempPath, self.__path)
+
+    #
+    # Приватные методы.
+    #
+
+    def __load(self):
+        '''Загрузка кэша с диска. Поврежденный или устаревший файл кэша игнорируется.'''
+        if not os.path.exists(self.__path):
+            return
+        try:
+            cacheFile = open(self.__path, 'rb')
+            try:
+                version, entries = marshal.load(cacheFile)
+            finally:
+                cacheFile.close()
+            if version != self.VERSION or not isinstance(entries, dict):
+                raise ValueError('unsupported cache version')
+        except Exception, e:
+            print >> self.__log, '[MetadataCache] ignoring cache "%s": %s' % (self.__path, e)
+            return
+
+        # Отбрасываем записи неверной структуры.
+        for key, entry in entries.iteritems():
+            if isinstance(entry, tuple) and len(entry) == 2 and isinstance(entry[0], tuple) and len(entry[0]) == 3:
+                self.__entries[key] = entry
+        print >> self.__log, '[MetadataCache] loaded "%s" (entries %d)' % (self.__path, len(self.__entries))
+
+    def __validMetadata(self, metadata):
+        '''Проверка структуры метаданных изображения.'''
+        try:
+            (width, height), (left, top, right, bottom), checksum = metadata
+        except (TypeError, ValueError):
+            return False
+        return width > 0 and height > 0 and 0 <= left < right <= width and 0 <= top < bottom <= height and \
+               isinstance(checksum, str)
@@ -0,0 +1,152 @@
+# coding: utf-8
+import sys
+import time
+import json
+import threading
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peakMemoryKB(withChildren=False):
+    '''
+    Пиковый расход памяти текущего процесса (и завершенных дочерних процессов при withChildren)
+    в килобайтах; None, если модуль resource недоступен. ru_maxrss в macOS измеряется в байтах.
+    '''
+    if resource is None:
+        return None
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if withChildren:
+        peakMemory = max(peakMemory, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':
+        peakMemory /= 1024
+    return peakMemory
+
+class BuildMetrics(object):
+    '''
+    Сбор метрик сборки атласов: суммарное время и количество вызовов по фазам (decode, trim, checksum,
+    fit-search, split, paste, optimize, save и т.д.) и счетчики (прочитанные и записанные байты).
+    Объект передается в AtlasManager и далее в загрузку изображений, алгоритмы размещения и запись атласов.
+    Собственная реализация должна предоставлять те же методы measure, wrap, addTime, addCount и merge
+    и свойство enabled. Время вложенных фаз входит во время объемлющих (например, повторное
+    декодирование изображения при paste).
+    '''
+
+    # Метрики включены: алгоритмы размещения оборачивают внутренние функции для замера времени.
+    enabled = True
+
+    def __init__(self):
+        '''Инициализация.'''
+        self.__startTime = time.time()
+        self.__lock = threading.Lock()
+        self.__phases = {}
+        self.__counters = {}
+
+    def measure(self, phase):
+        '''Возвращает контекст, время выполнения которого добавляется к заданной фазе.'''
+        return PhaseTimer(self, phase)
+
+    def wrap(self, phase, function):
+        '''Возвращает функцию, время выполнения которой добавляется к заданной фазе.'''
+        def measuredFunction(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                self.addTime(phase, time.time() - start)
+        return measuredFunction
+
+    def addTime(self, phase, seconds, calls=1):
+        '''Добавление времени и количества вызовов фазы.'''
+        with self.__lock:
+            phaseCalls, phaseSeconds = self.__phases.get(phase, (0, 0.0))
+            self.__phases[phase] = (phaseCalls + calls, phaseSeconds + seconds)
+
+    def addCount(self, counter, value=1):
+        '''Увеличение счетчика.'''
+        with self.__lock:
+            self.__counters[counter] = self.__counters.get(counter, 0) + value
+
+    def merge(self, report):
+        '''Добавление метрик, собранных в другом процессе (см. report).'''
+        for phase, phaseReport in report['phases'].iteritems():
+            self.addTime(phase, phaseReport['seconds'], phaseReport['calls'])
+        for counter, value in report['counters'].iteritems():
+            self.addCount(counter, value)
+
+    def report(self):
+        '''
+        Возвращает словарь с метриками: wallTime, phases (фаза -> calls, seconds), counters
+        и peakMemoryKB (пиковый расход памяти текущего и завершенных дочерних процессов).
+        '''
+        with self.__lock:
+            phases = dict((phase, {'calls': calls, 'seconds': seconds})
+                          for phase, (calls, seconds) in self.__phases.iteritems())
+            counters = dict(self.__counters)
+        return {'wallTime': time.time() - self.__startTime, 'phases': phases, 'counters': counters,
+                'peakMemoryKB': peakMemoryKB(withChildren=True)}
+
+    def save(self, path):
+        '''Запись метрик в файл JSON.'''
+        metricsFile = open(path, 'wt')
+        try:
+            json.dump(self.report(), metricsFile, indent=1, sort_keys=True)
+        finally:
+            metricsFile.close()
+
+    def printSummary(self, logFile):
+        '''Вывод метрик в виде таблицы.'''
+        report = self.report()
+        print >> logFile, '[BuildMetrics] wall time %.3fs, peak memory %s' % \
+                          (report['wallTime'], report['peakMemoryKB'] is not None and '%.1f MB' % (report['peakMemoryKB'] / 1024.0) or '-')
+        print >> logFile, ' * %-16s %10s %12s' % ('phase', 'calls', 'seconds')
+        for phase, phaseReport in sorted(report['phases'].iteritems(), key=lambda item: -item[1]['seconds']):
+            print >> logFile, ' * %-16s %10d %12.3f' % (phase, phaseReport['calls'], phaseReport['seconds'])
+        for counter, value in sorted(report['counters'].iteritems()):
+            print >> logFile, ' * %-16s %23d' % (counter, value)
+
+
+class PhaseTimer(object):
+    '''Контекст замера времени фазы (см. BuildMetrics.measure).'''
+    def __init__(self, metrics, phase):
+        self.__metrics = metrics
+        self.__phase = phase
+
+    def __enter__(self):
+        self.__start = time.time()
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.__metrics.addTime(self.__phase, time.time() - self.__start)
+
+
+class NullMetrics(object):
+    '''Метрики, которые не собираются (используются по умолчанию).'''
+
+    enabled = False
+
+    def measure(self, phase):
+        return NULL_TIMER
+
+    def wrap(self, phase, function):
+        return function
+
+    def addTime(self, phase, seconds, calls=1):
+        pass
+
+    def addCount(self, counter, value=1):
+        pass
+
+    def merge(self, report):
+        pass
+
+
+class NullTimer(object):
+    '''Пустой контекст для NullMetrics.'''
+    def __enter__(self):
+        pass
+
+    def __exit__(self, excType, excValue, excTraceback):
+        pass
+
+NULL_TIMER = NullTimer()
+NULL_METRICS = NullMetrics()
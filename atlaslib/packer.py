@@ -0,0 +1,623 @@
+# coding: utf-8
+from util import Size, Point, Rect
+from fitindex import FittableImageIndex
+from metrics import NULL_METRICS
+
+# Алгоритмы размещения изображений в атласах.
+PACKERS = {}
+
+# Эвристики выбора положения изображения для MaxRectsPacker, MultiBinPacker и GridPacker.
+MAXRECTS_HEURISTICS = ('short-side', 'area', 'bottom-left', 'contact-point')
+
+# Алгоритмы размещения, использующие эвристики MAXRECTS_HEURISTICS.
+MAXRECTS_PACKERS = ('maxrects', 'multibin', 'grid')
+
+# Допустимые размеры атласа при уменьшении атласа повторным размещением (см. shrinkAtlas).
+ATLAS_SIZINGS = ('pow2', 'mul4')
+
+class ImageGeometry(object):
+    '''
+    Геометрия изображения без пиксельных данных: заменяет AtlasImageInfo там, где для размещения
+    нужны только размеры (например, при размещении в дочерних процессах).
+    '''
+    def __init__(self, width, height, padding):
+        '''
+        Инициализация.
+            width, height   размер сохраняемого в атлас региона изображения.
+            padding         расстояние между соседними изображениями в атласе.
+        '''
+        self.sourceRect = Rect(Point(0, 0), Size(width, height))
+        self.paddedSourceRect = Rect(Point(0, 0), Size(width + padding, height + padding))
+
+class GuillotinePacker(object):
+    '''
+    Размещение изображений делением свободной области на две части (гильотинный разрез).
+    Для каждой свободной области выбирается наибольшее помещающееся изображение; способ разреза
+    определяется параметром сортировки.
+    Внутри алгоритма области хранятся как tuple (x, y, ширина, высота), объекты Point создаются
+    только для результата размещения.
+    При разрешенном повороте изображение поворачивается, только если в область не помещается
+    ни одно изображение в исходной ориентации.
+    '''
+    def __init__(self, images, atlasSize, padding, sortOn, heuristic=None, allowRotation=False, metrics=None):
+        '''
+        Инициализация.
+            images          список размещаемых изображений.
+            atlasSize       размер атласа.
+            padding         расстояние между соседними изображениями в атласе.
+            sortOn          параметр сортировки изображений (ширина или высота).
+            heuristic       не используется.
+            allowRotation   разрешить поворот изображений на 90 градусов.
+            metrics         объект для сбора метрик (фазы fit-search и split).
+        '''
+        assert isinstance(atlasSize, Size), 'Size must be Size instance'
+        assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
+        self.__atlasSize = atlasSize.sizeTuple
+        self.__sortOn = sortOn
+        self.__allowRotation = allowRotation
+
+        # Размеры изображений с отступами, чтобы не обращаться к свойствам в цикле размещения.
+        self.__paddedSizes = dict((image, image.paddedSourceRect.size.sizeTuple) for image in images)
+
+        # Сортируем изображения в порядке увеличения параметра сортировки (будем искать подходящее
+        # по размерам изображение начиная с конца.
+        sortIndex = sortOn == 'height' and 1 or 0
+        images = sorted(images, key=lambda i: self.__paddedSizes[i][sortIndex])
+        self.__candidates = FittableImageIndex(images, sortOn)
+
+        metrics = metrics or NULL_METRICS
+        self.__retainFittableImage = metrics.wrap('fit-search', self.__candidates.retainFittableImage)
+        self.__splitArea = metrics.wrap('split', self.__splitArea)
+
+    def __len__(self):
+        '''Количество неразмещенных изображений.'''
+        return len(self.__candidates)
+
+    def packAtlas(self):
+        '''
+        Размещение изображений в очередном атласе.
+        Возвращает список tuple (изображение, координата верхнего левого угла в атласе, повернуто ли изображение).
+        '''
+        retainFittableImage = self.__retainFittableImage
+        placements = []
+        areas = [(0, 0) + self.__atlasSize]
+        while areas:
+            # Ищем изображение, максимально подходящее по размеру.
+            x, y, width, height = areas.pop()
+            image = retainFittableImage(width, height)
+            rotated = False
+            if image is None and self.__allowRotation:
+                image = retainFittableImage(height, width)
+                rotated = True
+
+            # Если изображение не найдено, переходим к следующей области.
+            if image is None:
+                continue
+
+            # Размещаем изображение в верхний левый угол области и делим оставшееся пространство.
+            placements.append((image, Point(x, y), rotated))
+            imageWidth, imageHeight = self.__paddedSizes[image]
+            if rotated:
+                imageWidth, imageHeight = imageHeight, imageWidth
+            self.__splitArea(areas, x, y, width, height, imageWidth, imageHeight)
+        return placements
+
+    def __splitArea(self, areas, x, y, width, height, imageWidth, imageHeight):
+        '''
+        Деление области после размещения изображения в ее верхнем левом углу: добавляет в список
+        областей от нуля до двух прямоугольников справа и снизу от изображения.
+        '''
+        # Если размеры изображения с отступом больше, чем у области, обрезаем их.
+        imageWidth = min(imageWidth, width)
+        imageHeight = min(imageHeight, height)
+
+        # Создаем прямоугольники справа и снизу.
+        if self.__sortOn == 'height':
+#            ┌───┬───┐
+#            │ 3 │ 2 │
+#            ├───┴───┤
+#            │   1   │
+#            └───────┘
+            if height != imageHeight:
+                areas.append((x, y + imageHeight, width, height - imageHeight))
+            if width != imageWidth:
+                areas.append((x + imageWidth, y, width - imageWidth, imageHeight))
+        else:
+#            ┌───┬───┐
+#            │ 3 │   │
+#            ├───┤ 1 │
+#            │ 2 │   │
+#            └───┴───┘
+            if width != imageWidth:
+                areas.append((x + imageWidth, y, width - imageWidth, height))
+            if height != imageHeight:
+                areas.append((x, y + imageHeight, imageWidth, height - imageHeight))
+PACKERS['guillotine'] = GuillotinePacker
+
+class MaxRectsBin(object):
+    '''
+    Свободное пространство одного атласа для алгоритма MaxRects: набор максимальных (возможно,
+    пересекающихся) свободных прямоугольников. Прямоугольники хранятся как tuple (x, y, ширина, высота).
+    '''
+    def __init__(self, width, height, heuristic, allowRotation=False, metrics=None):
+        '''
+        Инициализация.
+            width, height   размер области (атлас, расширенный на величину отступа).
+            heuristic       эвристика выбора положения прямоугольника (см. MAXRECTS_HEURISTICS).
+            allowRotation   разрешить поворот прямоугольников на 90 градусов.
+            metrics         объект для сбора метрик (фазы fit-search и split).
+        '''
+        assert heuristic in MAXRECTS_HEURISTICS, 'Unknown MaxRects heuristic'
+        self.__heuristic = heuristic
+        self.__allowRotation = allowRotation
+        self.__freeRects = [(0, 0, width, height)]
+        self.__usedRects = []
+        self.__binSize = (width, height)
+        self.__maxFreeWidth, self.__maxFreeHeight = width, height
+
+        metrics = metrics or NULL_METRICS
+        self.findPosition = metrics.wrap('fit-search', self.findPosition)
+        self.placeRect = metrics.wrap('split', self.placeRect)
+
+    def canFit(self, width, height):
+        '''Быстрая проверка: может ли прямоугольник поместиться хотя бы в одну свободную область.'''
+        if width <= self.__maxFreeWidth and height <= self.__maxFreeHeight:
+            return True
+        return self.__allowRotation and height <= self.__maxFreeWidth and width <= self.__maxFreeHeight
+
+    def findPosition(self, width, height):
+        '''
+        Поиск положения прямоугольника заданного размера. Возвращает tuple (оценка, x, y, повернут ли
+        прямоугольник) или None, если положение не найдено. Меньшая оценка лучше; при равной оценке
+        предпочитается исходная ориентация.
+        '''
+        tryRotated = self.__allowRotation and width != height
+        bestScore = None
+        bestPosition = None
+        for freeX, freeY, freeWidth, freeHeight in self.__freeRects:
+            if freeWidth >= width and freeHeight >= height:
+                score = self.__score(freeX, freeY, freeWidth, freeHeight, width, height)
+                if bestScore is None or score < bestScore:
+                    bestScore = score
+                    bestPosition = (freeX, freeY, False)
+            if tryRotated and freeWidth >= height and freeHeight >= width:
+                score = self.__score(freeX, freeY, freeWidth, freeHeight, height, width)
+                if bestScore is None or score < bestScore:
+                    bestScore = score
+                    bestPosition = (freeX, freeY, True)
+        return bestPosition and (bestScore,) + bestPosition
+
+    def placeRect(self, rect):
+        '''Размещение прямоугольника: разрезание пересекающихся с ним свободных областей.'''
+        x, y, width, height = rect
+        freeRects = []
+        splitRects = []
+        for freeRect in self.__freeRects:
+            freeX, freeY, freeWidth, freeHeight = freeRect
+            if x >= freeX + freeWidth or x + width <= freeX or y >= freeY + freeHeight or y + height <= freeY:
+                freeRects.append(freeRect)
+                continue
+
+            # Оставляем максимальные прямоугольники по каждую сторону от размещенного.
+            if x > freeX:
+                splitRects.append((freeX, freeY, x - freeX, freeHeight))
+            if x + width < freeX + freeWidth:
+                splitRects.append((x + width, freeY, freeX + freeWidth - x - width, freeHeight))
+            if y > freeY:
+                splitRects.append((freeX, freeY, freeWidth, y - freeY))
+            if y + height < freeY + freeHeight:
+                splitRects.append((freeX, y + height, freeWidth, freeY + freeHeight - y - height))
+
+        # Нетронутые свободные прямоугольники не вложены друг в друга и не могут оказаться внутри
+        # новых (новые лежат внутри разрезанных), поэтому проверяем на вложенность только новые.
+        acceptedRects = []
+        for splitRect in sorted(set(splitRects), key=lambda r: r[2] * r[3], reverse=True):
+            if not self.__isContained(splitRect, acceptedRects) and not self.__isContained(splitRect, freeRects):
+                acceptedRects.append(splitRect)
+        self.__freeRects = freeRects + acceptedRects
+        self.__usedRects.append(rect)
+        self.__maxFreeWidth = max([freeRect[2] for freeRect in self.__freeRects] or [0])
+        self.__maxFreeHeight = max([freeRect[3] for freeRect in self.__freeRects] or [0])
+
+    #
+    # Приватные методы.
+    #
+
+    def __score(self, freeX, freeY, freeWidth, freeHeight, width, height):
+        '''Оценка положения прямоугольника в левом верхнем углу свободной области (меньше - лучше).'''
+        leftoverX = freeWidth - width
+        leftoverY = freeHeight - height
+        if self.__heuristic == 'short-side':
+            return (min(leftoverX, leftoverY), max(leftoverX, leftoverY))
+        elif self.__heuristic == 'area':
+            return (freeWidth * freeHeight - width * height, min(leftoverX, leftoverY))
+        elif self.__heuristic == 'bottom-left':
+            return (freeY + height, freeX)
+        return (-self.__contactScore(freeX, freeY, width, height), freeY, freeX)
+
+    def __contactScore(self, x, y, width, height):
+        '''Суммарная длина соприкосновения прямоугольника с границами атласа и размещенными прямоугольниками.'''
+        binWidth, binHeight = self.__binSize
+        score = 0
+        if x == 0 or x + width == binWidth:
+            score += height
+        if y == 0 or y + height == binHeight:
+            score += width
+        for usedX, usedY, usedWidth, usedHeight in self.__usedRects:
+            if usedX == x + width or usedX + usedWidth == x:
+                score += max(0, min(y + height, usedY + usedHeight) - max(y, usedY))
+            if usedY == y + height or usedY + usedHeight == y:
+                score += max(0, min(x + width, usedX + usedWidth) - max(x, usedX))
+        return score
+
+    def __isContained(self, rect, rects):
+        '''Проверка, содержится ли прямоугольник целиком в одном из заданных.'''
+        x, y, width, height = rect
+        for otherX, otherY, otherWidth, otherHeight in rects:
+            if otherX <= x and otherY <= y and x + width <= otherX + otherWidth and y + height <= otherY + otherHeight:
+                return True
+        return False
+
+def sortedImageRecords(images, sortOn, allowRotation):
+    '''
+    Изображения в порядке размещения алгоритмами MaxRects: список tuple (ширина с отступом,
+    высота с отступом, изображение), отсортированный по убыванию параметра сортировки.
+    '''
+    records = [image.paddedSourceRect.size.sizeTuple + (image,) for image in images]
+    if allowRotation:
+        # Ориентация изображения выбирается при размещении, поэтому сортируем по длинной стороне.
+        records.sort(key=lambda i: (max(i[0], i[1]), min(i[0], i[1])), reverse=True)
+    elif sortOn == 'height':
+        records.sort(key=lambda i: (i[1], i[0]), reverse=True)
+    else:
+        records.sort(key=lambda i: (i[0], i[1]), reverse=True)
+    return records
+
+class MaxRectsPacker(object):
+    '''
+    Размещение изображений алгоритмом MaxRects: свободное пространство атласа хранится как набор
+    максимальных (возможно, пересекающихся) свободных прямоугольников (см. MaxRectsBin), поэтому
+    размещение изображения не закрепляет разрез за одним из двух вариантов, как в GuillotinePacker.
+    Изображения перебираются по убыванию параметра сортировки, положение выбирается эвристикой.
+    При разрешенном повороте для каждой свободной области оцениваются обе ориентации изображения.
+    '''
+    def __init__(self, images, atlasSize, padding, sortOn, heuristic=None, allowRotation=False, metrics=None):
+        '''
+        Инициализация.
+            images          список размещаемых изображений.
+            atlasSize       размер атласа.
+            padding         расстояние между соседними изображениями в атласе.
+            sortOn          параметр сортировки изображений (ширина или высота).
+            heuristic       эвристика выбора положения изображения (см. MAXRECTS_HEURISTICS),
+                            по умолчанию 'short-side'.
+            allowRotation   разрешить поворот изображений на 90 градусов.
+            metrics         объект для сбора метрик (фазы fit-search и split).
+        '''
+        heuristic = heuristic or MAXRECTS_HEURISTICS[0]
+        assert isinstance(atlasSize, Size), 'Size must be Size instance'
+        assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
+        assert heuristic in MAXRECTS_HEURISTICS, 'Unknown MaxRects heuristic'
+        self.__atlasSize = atlasSize
+        self.__padding = padding
+        self.__heuristic = heuristic
+        self.__allowRotation = allowRotation
+        self.__metrics = metrics
+
+        # Храним изображения как tuple (ширина с отступом, высота с отступом, изображение).
+        self.__images = sortedImageRecords(images, sortOn, allowRotation)
+
+    def __len__(self):
+        '''Количество неразмещенных изображений.'''
+        return len(self.__images)
+
+    def packAtlas(self):
+        '''
+        Размещение изображений в очередном атласе.
+        Возвращает список tuple (изображение, координата верхнего левого угла в атласе, повернуто ли изображение).
+        '''
+        # Отступ справа и снизу от изображения может выходить за границу атласа, поэтому расширяем
+        # атлас на величину отступа и размещаем изображения вместе с отступами.
+        atlasBin = MaxRectsBin(self.__atlasSize.width + self.__padding, self.__atlasSize.height + self.__padding,
+                               self.__heuristic, self.__allowRotation, self.__metrics)
+
+        placements = []
+        remainingImages = []
+        for record in self.__images:
+            # Изображения, которые больше любой свободной области, пропускаем без поиска положения.
+            width, height, image = record
+            position = atlasBin.canFit(width, height) and atlasBin.findPosition(width, height)
+            if not position:
+                remainingImages.append(record)
+                continue
+            score, x, y, rotated = position
+            if rotated:
+                atlasBin.placeRect((x, y, height, width))
+            else:
+                atlasBin.placeRect((x, y, width, height))
+            placements.append((image, Point(x, y), rotated))
+        self.__images = remainingImages
+        return placements
+PACKERS['maxrects'] = MaxRectsPacker
+
+class MultiBinPacker(object):
+    '''
+    Размещение изображений алгоритмом MaxRects сразу во всех открытых атласах: каждое изображение
+    помещается в атлас с лучшей оценкой положения среди всех открытых (при равной оценке - в атлас
+    с меньшим номером), новый атлас открывается, только если изображение не помещается ни в один.
+    Поэтому мелкие изображения заполняют пустоты первых атласов, а не переносятся в следующие.
+    Атлас закрывается, когда в нем не помещается ни одно из оставшихся изображений.
+    Все атласы размещаются при первом вызове packAtlas, последующие вызовы возвращают готовые атласы.
+    '''
+    def __init__(self, images, atlasSize, padding, sortOn, heuristic=None, allowRotation=False, metrics=None):
+        '''
+        Инициализация (параметры как у MaxRectsPacker).
+        '''
+        heuristic = heuristic or MAXRECTS_HEURISTICS[0]
+        assert isinstance(atlasSize, Size), 'Size must be Size instance'
+        assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
+        assert heuristic in MAXRECTS_HEURISTICS, 'Unknown MaxRects heuristic'
+        self.__atlasSize = atlasSize
+        self.__padding = padding
+        self.__heuristic = heuristic
+        self.__allowRotation = allowRotation
+        self.__metrics = metrics
+
+        self.__images = sortedImageRecords(images, sortOn, allowRotation)
+        # Размещения готовых атласов, еще не возвращенных packAtlas.
+        self.__atlases = None
+
+    def __len__(self):
+        '''Количество неразмещенных изображений и готовых, но не возвращенных атласов.'''
+        return len(self.__images) + len(self.__atlases or [])
+
+    def packAtlas(self):
+        '''
+        Размещение изображений в очередном атласе.
+        Возвращает список tuple (изображение, координата верхнего левого угла в атласе, повернуто ли изображение).
+        '''
+        if self.__atlases is None:
+            self.__packAll()
+        if self.__atlases:
+            return self.__atlases.pop(0)
+        # Оставшиеся изображения не помещаются даже в пустой атлас.
+        return []
+
+    #
+    # Приватные методы.
+    #
+
+    def __packAll(self):
+        '''Размещение всех изображений в открываемых по необходимости атласах.'''
+        binWidth, binHeight = self.__atlasSize.width + self.__padding, self.__atlasSize.height + self.__padding
+
+        # Наименьшие размеры среди изображений, начиная с каждого: по ним закрываются заполненные атласы.
+        minSides = [None] * (len(self.__images) + 1)
+        for index in xrange(len(self.__images) - 1, -1, -1):
+            width, height, image = self.__images[index]
+            if self.__allowRotation:
+                width = height = min(width, height)
+            nextSides = minSides[index + 1] or (width, height)
+            minSides[index] = (min(width, nextSides[0]), min(height, nextSides[1]))
+
+        bins = []
+        atlases = []
+        openIndices = []
+        remainingImages = []
+        for index, record in enumerate(self.__images):
+            width, height, image = record
+            minWidth, minHeight = minSides[index]
+            openIndices = [binIndex for binIndex in openIndices if bins[binIndex].canFit(minWidth, minHeight)]
+
+            best = None
+            for binIndex in openIndices:
+                atlasBin = bins[binIndex]
+                if not atlasBin.canFit(width, height):
+                    continue
+                position = atlasBin.findPosition(width, height)
+                if position is not None and (best is None or position[0] < best[1][0]):
+                    best = (binIndex, position)
+
+            if best is None:
+                atlasBin = MaxRectsBin(binWidth, binHeight, self.__heuristic, self.__allowRotation, self.__metrics)
+                position = atlasBin.canFit(width, height) and atlasBin.findPosition(width, height)
+                if not position:
+                    remainingImages.append(record)
+                    continue
+                best = (len(bins), position)
+                openIndices.append(len(bins))
+                bins.append(atlasBin)
+                atlases.append([])
+
+            binIndex, (score, x, y, rotated) = best
+            if rotated:
+                bins[binIndex].placeRect((x, y, height, width))
+            else:
+                bins[binIndex].placeRect((x, y, width, height))
+            atlases[binIndex].append((image, Point(x, y), rotated))
+        self.__images = remainingImages
+        self.__atlases = atlases
+PACKERS['multibin'] = MultiBinPacker
+
+class GridPacker(object):
+    '''
+    Размещение изображений алгоритмом MaxRects, в котором изображения одинакового размера (например,
+    кадры анимации) размещаются не по одному, а блоками: прямоугольными сетками ячеек. Для блока
+    ищется одно положение и разрезается одна свободная область, положения изображений в блоке
+    вычисляются, поэтому работа на изображение не зависит от количества свободных областей.
+    В пустом атласе первый блок - сетка из наибольшего возможного количества ячеек; если блок
+    не помещается, количество его строк, а затем столбцов уменьшается вдвое.
+    Изображения разного размера перебираются в том же порядке, что и в MaxRectsPacker, и при отсутствии
+    изображений одинакового размера размещаются так же.
+    '''
+    def __init__(self, images, atlasSize, padding, sortOn, heuristic=None, allowRotation=False, metrics=None):
+        '''
+        Инициализация (параметры как у MaxRectsPacker).
+        '''
+        heuristic = heuristic or MAXRECTS_HEURISTICS[0]
+        assert isinstance(atlasSize, Size), 'Size must be Size instance'
+        assert sortOn in ('width', 'height'), 'SortOn must be either width or height'
+        assert heuristic in MAXRECTS_HEURISTICS, 'Unknown MaxRects heuristic'
+        self.__binSize = (atlasSize.width + padding, atlasSize.height + padding)
+        self.__heuristic = heuristic
+        self.__allowRotation = allowRotation
+        self.__metrics = metrics
+
+        # Группы изображений одинакового размера в порядке первого изображения группы:
+        # список [ширина ячейки, высота ячейки, повернуты ли изображения, список изображений].
+        self.__groups = []
+        groupsBySize = {}
+        for width, height, image in sortedImageRecords(images, sortOn, allowRotation):
+            if (width, height) not in groupsBySize:
+                groupsBySize[width, height] = [width, height, False, []]
+                self.__groups.append(groupsBySize[width, height])
+            groupsBySize[width, height][3].append(image)
+
+        # При разрешенном повороте выбираем ориентацию ячеек, при которой в атласе помещается больше ячеек
+        # (ориентация отдельного изображения выбирается при размещении, как в MaxRectsPacker).
+        if allowRotation:
+            for group in self.__groups:
+                width, height = group[0], group[1]
+                if len(group[3]) > 1 and self.__cellCount(height, width) > self.__cellCount(width, height):
+                    group[0], group[1], group[2] = height, width, True
+
+    def __len__(self):
+        '''Количество неразмещенных изображений.'''
+        return sum(len(group[3]) for group in self.__groups)
+
+    def packAtlas(self):
+        '''
+        Размещение изображений в очередном атласе.
+        Возвращает список tuple (изображение, координата верхнего левого угла в атласе, повернуто ли изображение).
+        '''
+        atlasBin = MaxRectsBin(self.__binSize[0], self.__binSize[1], self.__heuristic, self.__allowRotation, self.__metrics)
+        placements = []
+        for group in self.__groups:
+            self.__placeGroup(atlasBin, group, placements)
+        self.__groups = [group for group in self.__groups if group[3]]
+        return placements
+
+    #
+    # Приватные методы.
+    #
+
+    def __cellCount(self, cellWidth, cellHeight):
+        '''Количество ячеек заданного размера (с отступом) в сетке на весь атлас.'''
+        return (self.__binSize[0] / cellWidth) * (self.__binSize[1] / cellHeight)
+
+    def __placeGroup(self, atlasBin, group, placements):
+        '''
+        Размещение изображений группы блоками, пока они помещаются в атлас. Размещенные изображения
+        удаляются из группы и добавляются в список размещений.
+        '''
+        cellWidth, cellHeight, rotated, images = group
+        maxRows = self.__binSize[1] / cellHeight
+        columns = min(len(images), self.__binSize[0] / cellWidth)
+        while images and columns:
+            # Блок из целых строк; если изображений меньше, чем столбцов, - одна неполная строка.
+            rows = min(len(images) / columns, maxRows)
+            position = None
+            while rows and not position:
+                position = atlasBin.canFit(columns * cellWidth, rows * cellHeight) and \
+                           atlasBin.findPosition(columns * cellWidth, rows * cellHeight)
+                if not position:
+                    rows >>= 1
+            if not position:
+                columns >>= 1
+                continue
+
+            # Повернутый блок - сетка из rows столбцов и columns строк повернутых ячеек.
+            score, x, y, blockRotated = position
+            if blockRotated:
+                atlasBin.placeRect((x, y, rows * cellHeight, columns * cellWidth))
+                for index in xrange(columns * rows):
+                    placements.append((images[index], Point(x + index / columns * cellHeight, y + index % columns * cellWidth),
+                                       not rotated))
+            else:
+                atlasBin.placeRect((x, y, columns * cellWidth, rows * cellHeight))
+                for index in xrange(columns * rows):
+                    placements.append((images[index], Point(x + index % columns * cellWidth, y + index / columns * cellHeight),
+                                       rotated))
+            del images[:columns * rows]
+            columns = min(len(images), columns)
+PACKERS['grid'] = GridPacker
+
+def largestImageSides(sizes, allowRotation=False):
+    '''
+    Наибольшие стороны изображений заданных размеров (список tuple (ширина, высота)), которые должен
+    вмещать атлас: tuple (ширина, высота), а с поворотом - (длинная сторона, короткая сторона),
+    так как каждое изображение можно повернуть длинной стороной вдоль любой стороны атласа.
+    '''
+    if allowRotation:
+        return max(max(size) for size in sizes), max(min(size) for size in sizes)
+    return max(width for width, height in sizes), max(height for width, height in sizes)
+
+def fitsImageSides(width, height, sides, allowRotation=False):
+    '''Вмещает ли атлас заданного размера наибольшие стороны изображений (см. largestImageSides).'''
+    if allowRotation:
+        return max(width, height) >= sides[0] and min(width, height) >= sides[1]
+    return width >= sides[0] and height >= sides[1]
+
+def shrinkAtlas(packer, placements, atlasSize, padding, sortOn, heuristic=None, sizing='pow2', allowRotation=False):
+    '''
+    Поиск наименьшего размера атласа, вмещающего все размещенные в нем изображения:
+    изображения атласа повторно размещаются в атласах меньшего размера, пока это удается.
+        packer      алгоритм размещения изображений (см. PACKERS).
+        placements  размещение изображений в атласе исходного размера (см. packAtlas).
+        atlasSize   исходный размер атласа.
+        padding, sortOn, heuristic, allowRotation  параметры алгоритма размещения.
+        sizing      допустимые размеры атласа (см. ATLAS_SIZINGS): 'pow2' - степени двойки,
+                    'mul4' - кратные четырем (для платформ, поддерживающих такие текстуры).
+    Возвращает tuple (размер атласа, размещение изображений).
+    '''
+    assert isinstance(atlasSize, Size), 'Size must be Size instance'
+    assert sizing in ATLAS_SIZINGS, 'Unknown atlas sizing'
+    images = [image for image, position, rotated in placements]
+
+    def pack(width, height):
+        '''Размещение всех изображений в атласе заданного размера; None, если они не помещаются.'''
+        atlasPacker = PACKERS[packer](images, Size(width, height), padding, sortOn, heuristic, allowRotation)
+        newPlacements = atlasPacker.packAtlas()
+        return not atlasPacker and newPlacements or None
+
+    # Меньше суммарной площади и размеров наибольшего изображения атлас быть не может.
+    imageArea = sum(image.sourceRect.size.width * image.sourceRect.size.height for image in images)
+    # С поворотом каждая сторона атласа не меньше наибольшей короткой стороны, а одна из них -
+    # и наибольшей длинной стороны (см. largestImageSides).
+    sides = largestImageSides([image.sourceRect.size.sizeTuple for image in images], allowRotation)
+    minWidth, minHeight = allowRotation and (sides[1], sides[1]) or sides
+
+    # Перебираем размеры-степени двойки в порядке возрастания площади.
+    widths = [atlasSize.width]
+    while widths[-1] >> 1 >= minWidth:
+        widths.append(widths[-1] >> 1)
+    heights = [atlasSize.height]
+    while heights[-1] >> 1 >= minHeight:
+        heights.append(heights[-1] >> 1)
+    width, height = atlasSize.sizeTuple
+    candidates = sorted((w * h, abs(w - h), w, h) for w in widths for h in heights
+                        if imageArea <= w * h < width * height and fitsImageSides(w, h, sides, allowRotation))
+    for area, aspect, candidateWidth, candidateHeight in candidates:
+        candidatePlacements = pack(candidateWidth, candidateHeight)
+        if candidatePlacements is not None:
+            width, height, placements = candidateWidth, candidateHeight, candidatePlacements
+            break
+
+    if sizing == 'mul4':
+        # Уменьшаем высоту, затем ширину двоичным поиском по значениям, кратным четырем.
+        lower = ((fitsImageSides(width, minHeight, sides, allowRotation) and minHeight or sides[0]) + 3) & ~3
+        while lower < height:
+            middle = ((lower + height) >> 1) & ~3
+            candidatePlacements = pack(width, middle)
+            if candidatePlacements is not None:
+                height, placements = middle, candidatePlacements
+            else:
+                lower = middle + 4
+        lower = ((fitsImageSides(minWidth, height, sides, allowRotation) and minWidth or sides[0]) + 3) & ~3
+        while lower < width:
+            middle = ((lower + width) >> 1) & ~3
+            candidatePlacements = pack(middle, height)
+            if candidatePlacements is not None:
+                width, placements = middle, candidatePlacements
+            else:
+                lower = middle + 4
+    return Size(width, height), placements
@@ -0,0 +1,140 @@
+# coding: utf-8
+import time
+import multiprocessing
+from util import Size
+from atlas import optimizedSize
+from atlaslayout import usedAtlasSize
+from packer import PACKERS, MAXRECTS_HEURISTICS, MAXRECTS_PACKERS, ImageGeometry, largestImageSides, fitsImageSides
+
+# Геометрия изображений, размещаемых в текущем процессе (см. setSearchImages).
+searchImages = None
+
+def packingStrategies(maxSize, minSide=256, packers=None):
+    '''
+    Список стратегий размещения для перебора: все сочетания параметра сортировки, алгоритма
+    размещения с его эвристиками и размеров атласа - степеней двойки от minSide до максимального.
+    Стратегия - словарь с ключами sortOn, packer, heuristic, atlasSize (tuple).
+    Если задан список алгоритмов размещения packers, перебираются только они.
+    '''
+    assert isinstance(maxSize, Size), 'Size must be Size instance'
+    widths = [maxSize.width]
+    while widths[-1] > minSide:
+        widths.append(widths[-1] >> 1)
+    heights = [maxSize.height]
+    while heights[-1] > minSide:
+        heights.append(heights[-1] >> 1)
+
+    packerHeuristics = [('guillotine', None)] + [(packer, heuristic) for packer in MAXRECTS_PACKERS for heuristic in MAXRECTS_HEURISTICS]
+    if packers is not None:
+        packerHeuristics = [(packer, heuristic) for packer, heuristic in packerHeuristics if packer in packers]
+    strategies = []
+    for width in widths:
+        for height in heights:
+            for packer, heuristic in packerHeuristics:
+                for sortOn in ('height', 'width'):
+                    strategies.append({'sortOn': sortOn, 'packer': packer, 'heuristic': heuristic,
+                                       'atlasSize': (width, height)})
+    return strategies
+
+def packAll(packer, atlasSize, withoutOptimize=False):
+    '''
+    Размещение всех изображений заданным алгоритмом.
+    Возвращает количество атласов и их суммарную площадь (после оптимизации размера, если она включена)
+    или None, если изображения не помещаются в атлас.
+    '''
+    atlasCount = 0
+    texels = 0
+    while packer:
+        placements = packer.packAtlas()
+        if not placements:
+            return None
+        size = atlasSize
+        if not withoutOptimize:
+            size = optimizedSize(atlasSize, usedAtlasSize(placements))
+        atlasCount += 1
+        texels += size.width * size.height
+    return atlasCount, texels
+
+def setSearchImages(sizes, padding):
+    '''
+    Задание геометрии изображений для оценки стратегий в текущем процессе.
+        sizes      список размеров (ширина, высота) сохраняемых в атлас регионов изображений.
+        padding    расстояние между соседними изображениями в атласе.
+    '''
+    global searchImages
+    searchImages = [ImageGeometry(width, height, padding) for width, height in sizes]
+
+def evaluateStrategy(args):
+    '''
+    Оценка стратегии размещения по tuple (индекс стратегии, стратегия, отступ, без оптимизации,
+    разрешен ли поворот). Возвращает tuple (индекс стратегии, результат packAll).
+    '''
+    index, strategy, padding, withoutOptimize, allowRotation = args
+    atlasSize = Size(*strategy['atlasSize'])
+    packer = PACKERS[strategy['packer']](searchImages, atlasSize, padding, strategy['sortOn'], strategy['heuristic'],
+                                         allowRotation)
+    return index, packAll(packer, atlasSize, withoutOptimize)
+
+def searchPackingStrategy(sizes, padding, maxSize, withoutOptimize, baseStrategy, workers=1, timeLimit=None, logFile=None,
+                          allowRotation=False, packers=None):
+    '''
+    Поиск стратегии размещения, дающей наименьшее количество атласов, а при равном количестве -
+    наименьшую суммарную площадь атласов. Базовая стратегия оценивается первой, поэтому при
+    исчерпании времени результат не хуже базового.
+        sizes           список размеров (ширина, высота) сохраняемых в атлас регионов изображений.
+        padding         расстояние между соседними изображениями в атласе.
+        maxSize         максимальный размер атласа.
+        withoutOptimize не учитывать оптимизацию размера атласов.
+        baseStrategy    базовая стратегия (см. packingStrategies).
+        workers         количество процессов.
+        timeLimit       ограничение времени поиска в секундах.
+        logFile         файл для вывода отладочной информации.
+        allowRotation   разрешить поворот изображений на 90 градусов.
+        packers         алгоритмы размещения для перебора, по умолчанию все.
+    Возвращает словарь стратегии.
+    '''
+    if logFile is None:
+        class DummyLog:
+            def write(*args):
+                pass
+        logFile = DummyLog()
+
+    startTime = time.time()
+    strategies = [baseStrategy] + [strategy for strategy in packingStrategies(maxSize, packers=packers)
+                                  if strategy != baseStrategy]
+
+    # Изображения, не помещающиеся в атлас меньшего размера, делают стратегию неприменимой.
+    sides = largestImageSides(sizes, allowRotation)
+    tasks = [(index, strategy, padding, withoutOptimize, allowRotation) for index, strategy in enumerate(strategies)
+             if index == 0 or fitsImageSides(strategy['atlasSize'][0], strategy['atlasSize'][1], sides, allowRotation)]
+
+    # Базовую стратегию оцениваем в текущем процессе.
+    setSearchImages(sizes, padding)
+    results = dict([evaluateStrategy(tasks[0])])
+    tasks = tasks[1:]
+    if workers > 1 and tasks:
+        pool = multiprocessing.Pool(workers, setSearchImages, (sizes, padding))
+        try:
+            for index, result in pool.imap_unordered(evaluateStrategy, tasks):
+                results[index] = result
+                if timeLimit is not None and time.time() - startTime > timeLimit:
+                    break
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for task in tasks:
+            if timeLimit is not None and time.time() - startTime > timeLimit:
+                break
+            index, result = evaluateStrategy(task)
+            results[index] = result
+
+    # Выбираем лучший результат, при равенстве - стратегию с меньшим индексом.
+    bestIndex = min((result + (index,) for index, result in results.iteritems() if result is not None))[-1]
+    best = strategies[bestIndex]
+    print >> logFile, '[PackingSearch] evaluated %d of %d strategies in %.1fs' % \
+                      (len(results), len(strategies), time.time() - startTime)
+    print >> logFile, ' * [PackingSearch] base: atlases %d, texels %d' % results[0]
+    print >> logFile, ' * [PackingSearch] best: %s/%s, sort on %s, atlas %d x %d: atlases %d, texels %d' % \
+                      ((best['packer'], best['heuristic'] or '-', best['sortOn']) + best['atlasSize'] + results[bestIndex])
+    return best
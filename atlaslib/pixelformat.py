@@ -0,0 +1,205 @@
+# coding: utf-8
+import struct
+from PIL import Image, ImageChops
+
+# Форматы пикселей текстуры атласа.
+PIXEL_FORMATS = ('rgba8888', 'rgba4444', 'rgb565', 'premultiplied')
+
+# Форматы файлов текстуры атласа.
+TEXTURE_CONTAINERS = ('png', 'ktx')
+
+# Количество бит на канал (R, G, B, A) для форматов с уменьшенной точностью.
+CHANNEL_BITS = {'rgba4444': (4, 4, 4, 4), 'rgb565': (5, 6, 5)}
+
+# Названия форматов пикселей в описании атласа (как в cocos2d и TexturePacker).
+PIXEL_FORMAT_NAMES = {'rgba8888': 'RGBA8888', 'rgba4444': 'RGBA4444', 'rgb565': 'RGB565', 'premultiplied': 'RGBA8888'}
+
+# Матрица упорядоченного дизеринга (Байера) 4x4, значения 0..15.
+BAYER_MATRIX = ((0, 8, 2, 10),
+                (12, 4, 14, 6),
+                (3, 11, 1, 9),
+                (15, 7, 13, 5))
+
+# Идентификатор файла KTX 1.1 и константы OpenGL для заголовка.
+KTX_IDENTIFIER = '\xabKTX 11\xbb\r\n\x1a\n'
+KTX_ENDIANNESS = 0x04030201
+GL_UNSIGNED_BYTE = 0x1401
+GL_UNSIGNED_SHORT_4_4_4_4 = 0x8033
+GL_UNSIGNED_SHORT_5_6_5 = 0x8363
+GL_RGB = 0x1907
+GL_RGBA = 0x1908
+GL_RGBA4 = 0x8056
+GL_RGBA8 = 0x8058
+GL_RGB565 = 0x8D62
+
+# (glType, glTypeSize, glFormat, glInternalFormat, glBaseInternalFormat) для форматов пикселей.
+KTX_FORMATS = {'rgba8888': (GL_UNSIGNED_BYTE, 1, GL_RGBA, GL_RGBA8, GL_RGBA),
+               'premultiplied': (GL_UNSIGNED_BYTE, 1, GL_RGBA, GL_RGBA8, GL_RGBA),
+               'rgba4444': (GL_UNSIGNED_SHORT_4_4_4_4, 2, GL_RGBA, GL_RGBA4, GL_RGBA),
+               'rgb565': (GL_UNSIGNED_SHORT_5_6_5, 2, GL_RGB, GL_RGB565, GL_RGB)}
+
+class TextureFormat(object):
+    '''
+    Формат записи текстуры атласа: формат пикселей, дизеринг и формат файла.
+    Преобразование выполняется над всей текстурой операциями PIL над каналами (point, ImageChops),
+    без обхода пикселей в Python. Дизеринг упорядоченный: каждый пиксель квантуется независимо
+    от соседей, поэтому ошибка квантования не переносится между изображениями, а прозрачные
+    пиксели отступов остаются нулевыми.
+    '''
+
+    def __init__(self, pixelFormat='rgba8888', dither=False, container='png'):
+        '''
+        Инициализация.
+            pixelFormat  формат пикселей (см. PIXEL_FORMATS).
+            dither       использовать упорядоченный дизеринг при уменьшении точности каналов.
+            container    формат файла (см. TEXTURE_CONTAINERS).
+        '''
+        assert pixelFormat in PIXEL_FORMATS, 'Unknown pixel format'
+        assert container in TEXTURE_CONTAINERS, 'Unknown texture container'
+        self.__pixelFormat = pixelFormat
+        self.__dither = dither and pixelFormat in CHANNEL_BITS
+        self.__container = container
+
+    @property
+    def pixelFormat(self):
+        '''Формат пикселей.'''
+        return self.__pixelFormat
+
+    @property
+    def pixelFormatName(self):
+        '''Название формата пикселей для описания атласа.'''
+        return PIXEL_FORMAT_NAMES[self.__pixelFormat]
+
+    @property
+    def premultipliedAlpha(self):
+        '''Умножены ли цветовые каналы на альфу.'''
+        return self.__pixelFormat == 'premultiplied'
+
+    @property
+    def extension(self):
+        '''Расширение файла текстуры.'''
+        return '.' + self.__container
+
+    @property
+    def isDefault(self):
+        '''Записывается ли текстура без преобразования в PNG.'''
+        return self.__pixelFormat == 'rgba8888' and self.__container == 'png'
+
+    def save(self, image, fileName):
+        '''Преобразование и запись текстуры атласа (Image в режиме RGBA).'''
+        assert image.mode == 'RGBA', 'Atlas image must be RGBA'
+        if self.__container == 'png':
+            convertImage(image, self.__pixelFormat, self.__dither).save(fileName)
+        else:
+            writeKtx(fileName, image, self.__pixelFormat, self.__dither)
+
+    def __str__(self):
+        '''Строковое представление (используется в параметрах сборки).'''
+        return '%s%s %s' % (self.__pixelFormat, self.__dither and ' dithered' or '', self.__container)
+
+
+def convertImage(image, pixelFormat, dither=False):
+    '''
+    Преобразование текстуры в заданный формат пикселей для записи в PNG: значения
+    квантованных каналов растягиваются обратно до 8 бит, в формате rgb565 альфа-канал отбрасывается.
+    '''
+    if pixelFormat == 'rgba8888':
+        return image
+    if pixelFormat == 'premultiplied':
+        return premultiplyAlpha(image)
+    channels = quantizeChannels(image, pixelFormat, dither)
+    bits = CHANNEL_BITS[pixelFormat]
+    expanded = [channel.point(expandTable(channelBits)) for channel, channelBits in zip(channels, bits)]
+    return Image.merge(len(expanded) == 4 and 'RGBA' or 'RGB', expanded)
+
+def premultiplyAlpha(image):
+    '''Умножение цветовых каналов на альфу.'''
+    red, green, blue, alpha = image.split()
+    return Image.merge('RGBA', [ImageChops.multiply(channel, alpha) for channel in (red, green, blue)] + [alpha])
+
+def quantizeChannels(image, pixelFormat, dither=False):
+    '''
+    Квантование каналов текстуры для формата rgba4444 или rgb565.
+    Возвращает список изображений в режиме L со значениями уровней каналов (0..2^bits - 1).
+    Альфа-канал не дизерится, чтобы не зашумлять края изображений.
+    '''
+    bits = CHANNEL_BITS[pixelFormat]
+    channels = image.split()[:len(bits)]
+    quantized = []
+    for index, (channel, channelBits) in enumerate(zip(channels, bits)):
+        if dither and index < 3:
+            # Уровень floor((c + d) / step), где порог d < step, поэтому 0 и 255 сохраняются.
+            channel = ImageChops.add(channel, ditherImage(image.size, channelBits))
+            quantized.append(channel.point(floorTable(channelBits)))
+        else:
+            quantized.append(channel.point(roundTable(channelBits)))
+    return quantized
+
+def ditherImage(size, bits):
+    '''Изображение в режиме L с порогами упорядоченного дизеринга для канала с заданным количеством бит.'''
+    width, height = size
+    step = 255.0 / ((1 << bits) - 1)
+    rows = [''.join(chr(int((value + 0.5) * step / 16)) for value in row) for row in BAYER_MATRIX]
+    rows = [(row * (width / 4 + 1))[:width] for row in rows]
+    data = ''.join(rows) * (height / 4 + 1)
+    return Image.frombytes('L', size, data[:width * height])
+
+def roundTable(bits):
+    '''Таблица для point: 8-битное значение -> ближайший уровень канала.'''
+    maxLevel = (1 << bits) - 1
+    return [int(value * maxLevel / 255.0 + 0.5) for value in xrange(256)]
+
+def floorTable(bits):
+    '''Таблица для point: 8-битное значение с порогом дизеринга -> уровень канала.'''
+    maxLevel = (1 << bits) - 1
+    return [int(value * maxLevel / 255.0) for value in xrange(256)]
+
+def expandTable(bits):
+    '''Таблица для point: уровень канала -> 8-битное значение.'''
+    maxLevel = (1 << bits) - 1
+    return [int(min(value, maxLevel) * 255.0 / maxLevel + 0.5) for value in xrange(256)]
+
+def packPixels(image, pixelFormat, dither=False):
+    '''Пиксели текстуры в заданном формате (строки подряд, 16-битные значения в little-endian).'''
+    if pixelFormat == 'rgba8888':
+        return image.tobytes()
+    if pixelFormat == 'premultiplied':
+        return premultiplyAlpha(image).tobytes()
+    channels = quantizeChannels(image, pixelFormat, dither)
+    if pixelFormat == 'rgba4444':
+        # R << 12 | G << 8 | B << 4 | A.
+        red, green, blue, alpha = channels
+        low = ImageChops.add(blue.point(lambda value: value << 4), alpha)
+        high = ImageChops.add(red.point(lambda value: value << 4), green)
+    else:
+        # R << 11 | G << 5 | B.
+        red, green, blue = channels
+        low = ImageChops.add(green.point(lambda value: (value & 7) << 5), blue)
+        high = ImageChops.add(red.point(lambda value: value << 3), green.point(lambda value: value >> 3))
+    # Режим LA хранит пары байт (L, A) подряд, что совпадает с 16-битным значением в little-endian.
+    return Image.merge('LA', (low, high)).tobytes()
+
+def writeKtx(fileName, image, pixelFormat, dither=False):
+    '''Запись текстуры в файл KTX 1.1 (один уровень mip, строки выровнены на 4 байта).'''
+    glType, glTypeSize, glFormat, glInternalFormat, glBaseInternalFormat = KTX_FORMATS[pixelFormat]
+    width, height = image.size
+    data = packPixels(image, pixelFormat, dither)
+    stride = len(data) / height
+    if stride % 4:
+        padding = '\0' * (-stride % 4)
+        data = ''.join(data[offset:offset + stride] + padding for offset in xrange(0, len(data), stride))
+
+    # Ориентация: первая строка - верхняя.
+    keyValue = 'KTXorientation\0S=r,T=d\0'
+    keyValue = struct.pack('<I', len(keyValue)) + keyValue + '\0' * (-len(keyValue) % 4)
+
+    ktxFile = open(fileName, 'wb')
+    try:
+        ktxFile.write(KTX_IDENTIFIER)
+        ktxFile.write(struct.pack('<13I', KTX_ENDIANNESS, glType, glTypeSize, glFormat, glInternalFormat,
+                                  glBaseInternalFormat, width, height, 0, 0, 1, 1, len(keyValue)))
+        ktxFile.write(keyValue)
+        ktxFile.write(struct.pack('<I', len(data)))
+        ktxFile.write(data)
+    finally:
+        ktxFile.close()
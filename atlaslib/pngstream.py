@@ -0,0 +1,69 @@
+# coding: utf-8
+import zlib
+import struct
+from PIL import Image
+from util import Size
+
+# Сигнатура файла PNG.
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+def writeBandedPng(fileName, size, images, bandHeight, compressLevel=6):
+    '''
+    Запись атласа в PNG (RGBA, 8 бит на канал) горизонтальными полосами без создания текстуры
+    атласа в памяти. Для каждой полосы компонуются только пересекающие ее изображения; регион
+    изображения загружается, когда до него доходит очередь, и освобождается после последней
+    полосы, которую он пересекает. Поэтому расход памяти пропорционален высоте полосы
+    (и высоте самых высоких изображений), а не площади атласа.
+        fileName       имя файла.
+        size           размер атласа.
+        images         размещенные в атласе изображения без дубликатов (AtlasImageInfo).
+        bandHeight     высота полосы в строках.
+        compressLevel  уровень сжатия zlib.
+    '''
+    assert isinstance(size, Size), 'Size must be Size instance'
+    assert bandHeight > 0, 'Band height must be positive'
+    width, height = size.sizeTuple
+    stride = width * 4
+
+    # Изображения в порядке появления в полосах.
+    pending = sorted(images, key=lambda image: image.atlasPosition.y)
+    pendingIndex = 0
+    activeImages = []
+
+    pngFile = open(fileName, 'wb')
+    try:
+        pngFile.write(PNG_SIGNATURE)
+        writePngChunk(pngFile, 'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        compressor = zlib.compressobj(compressLevel)
+        for bandTop in xrange(0, height, bandHeight):
+            bandBottom = min(bandTop + bandHeight, height)
+
+            # Загружаем изображения, начинающиеся в текущей полосе.
+            while pendingIndex < len(pending) and pending[pendingIndex].atlasPosition.y < bandBottom:
+                image = pending[pendingIndex]
+                activeImages.append((image.atlasPosition.x, image.atlasPosition.y, image.trimmedImage()))
+                pendingIndex += 1
+
+            # Компонуем полосу; части изображений за ее границами отсекаются при копировании.
+            band = Image.new('RGBA', (width, bandBottom - bandTop))
+            for x, y, trimmedImage in activeImages:
+                band.paste(trimmedImage, (x, y - bandTop))
+            activeImages = [active for active in activeImages if active[1] + active[2].size[1] > bandBottom]
+
+            # Каждая строка предваряется байтом типа фильтра (0 - без фильтрации).
+            data = band.tobytes()
+            rows = ''.join('\x00' + data[offset:offset + stride] for offset in xrange(0, len(data), stride))
+            writePngChunk(pngFile, 'IDAT', compressor.compress(rows))
+        writePngChunk(pngFile, 'IDAT', compressor.flush())
+        writePngChunk(pngFile, 'IEND', '')
+    finally:
+        pngFile.close()
+
+def writePngChunk(pngFile, chunkType, data):
+    '''Запись блока PNG. Пустые блоки IDAT не записываются.'''
+    if not data and chunkType == 'IDAT':
+        return
+    pngFile.write(struct.pack('>I', len(data)))
+    pngFile.write(chunkType)
+    pngFile.write(data)
+    pngFile.write(struct.pack('>I', zlib.crc32(chunkType + data) & 0xffffffff))
@@ -1,4 +1,5 @@
 # coding: utf-8
+import os
 
 class Size(object):
     '''Представление для размера'''
@@ -97,3 +98,9 @@ class Rect(object):
         assert isinstance(size, Size), 'Size must be Size instance'
         return self.__size.canFit(size)
     
+
+
+def fileStamp(path):
+    '''Состояние файла для обнаружения изменений: tuple (время модификации, размер).'''
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size)
@@ -0,0 +1,74 @@
+# coding: utf-8
+import os
+import time
+from util import fileStamp
+
+def findImages(directory):
+    '''Список пар (имя файла, путь к файлу) изображений PNG в каталоге и подкаталогах в порядке обхода.'''
+    images = []
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            basename, ext = os.path.splitext(filename)
+            if ext != '.png':
+                continue
+            images.append((filename, os.path.join(root, filename)))
+    return images
+
+
+class DirectoryWatcher(object):
+    '''
+    Наблюдение за изображениями в каталоге. Изменения определяются опросом: каталог обходится
+    заново и сравниваются время модификации и размер файлов (десятки миллисекунд на 10 тысяч файлов).
+    '''
+
+    def __init__(self, directory, interval=0.5):
+        '''
+        Инициализация и первый обход каталога.
+            directory   каталог с изображениями.
+            interval    интервал опроса в секундах.
+        '''
+        assert interval > 0, 'Poll interval must be positive'
+        self.__directory = directory
+        self.__interval = interval
+        self.__images, self.__state = self.__scan()
+
+    @property
+    def images(self):
+        '''Список пар (имя файла, путь к файлу) при последнем обходе (см. findImages).'''
+        return self.__images
+
+    def waitForChanges(self):
+        '''
+        Ожидание изменения набора изображений. Возвращает новый список изображений, когда файлы
+        перестают меняться в течение интервала опроса (чтобы не собирать атласы из недописанных файлов).
+        '''
+        while True:
+            time.sleep(self.__interval)
+            images, state = self.__scan()
+            if state == self.__state:
+                continue
+            while True:
+                time.sleep(self.__interval)
+                stableImages, stableState = self.__scan()
+                if stableState == state:
+                    break
+                images, state = stableImages, stableState
+            self.__images, self.__state = images, state
+            return images
+
+    #
+    # Приватные методы.
+    #
+
+    def __scan(self):
+        '''Обход каталога. Возвращает tuple (список изображений, словарь путь -> состояние файла).'''
+        images = []
+        state = {}
+        for imageName, imagePath in findImages(self.__directory):
+            # Файл мог быть удален после обхода каталога.
+            try:
+                state[imagePath] = fileStamp(imagePath)
+            except OSError:
+                continue
+            images.append((imageName, imagePath))
+        return images, state
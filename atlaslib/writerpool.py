@@ -0,0 +1,97 @@
+# coding: utf-8
+import os
+import sys
+import threading
+import Queue
+from metrics import NULL_METRICS
+
+class AtlasWriterPool(object):
+    '''
+    Запись атласов в фоновых потоках: пока сжимается PNG очередного атласа, размещение и
+    компоновка следующих атласов продолжаются. Сжатие zlib отпускает GIL, поэтому потоков достаточно.
+    Очередь ожидающих записи атласов ограничена количеством потоков, так что в памяти одновременно
+    находится не более 2 * workers готовых атласов.
+    '''
+
+    def __init__(self, writer, workers=1, metrics=None):
+        '''
+        Инициализация.
+            writer      объект для записи атласов (см. WRITERS).
+            workers     количество потоков записи; 0 - запись в вызывающем потоке.
+            metrics     объект для сбора метрик (фаза save и количество записанных байт).
+        '''
+        assert workers >= 0, 'Worker count must be non-negative'
+        self.__writer = writer
+        self.__metrics = metrics or NULL_METRICS
+        self.__error = None
+        self.__aborted = False
+        self.__errorLock = threading.Lock()
+        self.__queue = Queue.Queue(max(workers, 1))
+        self.__threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self.__run, name='AtlasWriter-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def writeAtlas(self, baseName, atlas):
+        '''
+        Постановка атласа в очередь записи. Блокируется, если очередь заполнена.
+        Если запись одного из предыдущих атласов завершилась ошибкой, возбуждает ее.
+        '''
+        self.__raiseError()
+        if not self.__threads:
+            self.__write(baseName, atlas)
+            return
+        self.__queue.put((baseName, atlas))
+
+    def join(self):
+        '''Ожидание записи всех атласов. Возбуждает ошибку записи, если она произошла.'''
+        self.close()
+        self.__raiseError()
+
+    def abort(self):
+        '''Остановка потоков записи без записи поставленных в очередь атласов (при ошибке сборки).'''
+        self.__aborted = True
+        self.close()
+
+    def close(self):
+        '''Остановка потоков записи после обработки поставленных в очередь атласов.'''
+        threads, self.__threads = self.__threads, []
+        for thread in threads:
+            self.__queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    #
+    # Приватные методы.
+    #
+
+    def __run(self):
+        '''Цикл потока записи.'''
+        while True:
+            task = self.__queue.get()
+            if task is None:
+                break
+            # После первой ошибки или отмены оставшиеся атласы не записываем, но очередь разбираем.
+            if self.__error is not None or self.__aborted:
+                continue
+            try:
+                self.__write(*task)
+            except:
+                with self.__errorLock:
+                    if self.__error is None:
+                        self.__error = sys.exc_info()
+
+    def __write(self, baseName, atlas):
+        '''Запись атласа с замером времени и размера записанных файлов.'''
+        with self.__metrics.measure('save'):
+            self.__writer.writeAtlas(baseName, atlas)
+        if self.__metrics.enabled:
+            self.__metrics.addCount('bytesWritten', sum(os.path.getsize(fileName) for fileName in self.__writer.atlasFiles(baseName)))
+
+    def __raiseError(self):
+        '''Возбуждение ошибки записи в вызывающем потоке с исходной трассировкой.'''
+        if self.__error is not None:
+            excType, excValue, excTraceback = self.__error
+            raise excType, excValue, excTraceback
@@ -1,16 +1,30 @@
 # coding: utf8
-import sys, os, os.path, optparse
+import sys, os, os.path, optparse, time
 from atlaslib.atlasmanager import AtlasManager
+from atlaslib.atlas import parseScales, packingPadding
 from atlaslib.atlaswriter import WRITERS
+from atlaslib.packer import PACKERS, MAXRECTS_HEURISTICS, MAXRECTS_PACKERS, ATLAS_SIZINGS
+from atlaslib.metadatacache import MetadataCache
+from atlaslib.buildmanifest import BuildManifest
+from atlaslib.metrics import BuildMetrics
+from atlaslib.pixelformat import TextureFormat, PIXEL_FORMATS, TEXTURE_CONTAINERS
+from atlaslib.watcher import DirectoryWatcher, findImages
+from atlaslib.batch import GROUP_OPTIONS, loadBatchConfig, subdirectoryGroups, checkGroupOutputs, runBatch, printBatchSummary
 
 if __name__ == '__main__':
-    USAGE = 'usage: %prog [options] directory'
+    USAGE = 'usage: %prog [options] directory\n       %prog [options] --batch CONFIG'
     VERSION = '%prog 0.1'
     
     # Разбор командной строки.
     parser = optparse.OptionParser(usage=USAGE, version=VERSION)
     parser.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False,
                       help='verbose output')
+    parser.add_option('', '--profile', action='store_true', dest='profile', default=False,
+                      help='print time spent in each build phase, peak memory and bytes read and written')
+    parser.add_option('', '--metrics-json', action='store', dest='metricsJson', default=None,
+                      help='write build metrics to JSON file')
+    parser.add_option('-j', '--jobs', type='int', action='store', dest='jobs', default=1,
+                      help='number of processes used to load images [default %default]')
     group = optparse.OptionGroup(parser, 'Atlas options')
     group.add_option('-W', '--max-width', type='int', action='store', dest='maxWidth', default=2048,
                       help='max atlas width [default %default]')
@@ -20,12 +34,28 @@ if __name__ == '__main__':
                       help='atlas image padding [default %default]')
     group.add_option('-s', '--sort-on', action='store', dest='sortOn', default='height',
                       help='sort parameter (width or height) [default "%default"]')
+    group.add_option('', '--packer', action='store', dest='packer', default='guillotine',
+                      help='packing algorithm (%s) [default "%%default"]' % ', '.join(sorted(PACKERS.keys())))
+    group.add_option('', '--heuristic', action='store', dest='heuristic', default=None,
+                      help='maxrects, multibin and grid placement heuristic (%s) [default "%s"]' % (', '.join(MAXRECTS_HEURISTICS), MAXRECTS_HEURISTICS[0]))
+    group.add_option('', '--allow-rotation', action='store_true', dest='allowRotation', default=False,
+                      help='allow placing images rotated by 90 degrees clockwise')
+    group.add_option('', '--search', action='store_true', dest='search', default=False,
+                      help='try all sort parameters, packers and atlas sizes and keep the one with fewest atlases')
+    group.add_option('', '--search-time', type='float', action='store', dest='searchTime', default=None,
+                      help='time limit for packing search in seconds')
     group.add_option('', '--skip-dimension-sum', type='int', action='store', dest='skipDimensionSum', default=1 << 32,
                       help='skip images with dimension sum greater then [default %default]')
     group.add_option('-a', '--alpha-threshold', type='int', action='store', dest='alphaThreshold', default=1,
                       help='alpha threshold for image trimming [default %default]')
     group.add_option('', '--no-optimize', action='store_true', dest='dontOptimize', default=False,
                       help='disable atlas size optimization')
+    group.add_option('', '--shrink', action='store', dest='sizing', default=None,
+                      help='shrink atlases by repacking them into smaller sizes (%s)' % ', '.join(ATLAS_SIZINGS))
+    group.add_option('', '--lazy-load', action='store_true', dest='lazyLoad', default=False,
+                      help='keep only image geometry in memory and decode images again while compositing')
+    group.add_option('', '--cache', action='store', dest='cache', default=None,
+                      help='image metadata cache file, unchanged images are not decoded again')
 
     parser.add_option_group(group)
     
@@ -36,40 +66,220 @@ if __name__ == '__main__':
                       help='output directory [default "%default"]')
     group.add_option('-n', '--output-name', action='store', dest='outputName', default='atlas',
                       help='output filename [default "%default"]')
+    group.add_option('-i', '--incremental', action='store_true', dest='incremental', default=False,
+                      help='rewrite only atlases whose images changed since the previous build')
+    group.add_option('', '--write-jobs', type='int', action='store', dest='writeJobs', default=1,
+                      help='number of threads encoding atlases while packing continues, '
+                           'also the number of atlases waiting to be written (0 to write in place) [default %default]')
+    group.add_option('', '--band-height', type='int', action='store', dest='bandHeight', default=0,
+                      help='write atlas PNGs in bands of this many rows without keeping whole atlas in memory '
+                           '(0 to disable, use with --lazy-load for lowest memory) [default %default]')
+    group.add_option('', '--pixel-format', action='store', dest='pixelFormat', default='rgba8888',
+                      help='atlas texture pixel format (%s) [default "%%default"]' % ', '.join(PIXEL_FORMATS))
+    group.add_option('', '--dither', action='store_true', dest='dither', default=False,
+                      help='use ordered dithering when converting to rgba4444 or rgb565')
+    group.add_option('', '--texture-container', action='store', dest='textureContainer', default='png',
+                      help='atlas texture file format (%s) [default "%%default"]' % ', '.join(TEXTURE_CONTAINERS))
+    group.add_option('', '--scales', action='store', dest='scales', default=None,
+                      help='comma-separated output scales in range (0, 1], e.g. "1,0.5": atlases are packed once '
+                           'by maxrects, multibin or grid packer and downscaled, names of scaled atlases get "@<scale>x" suffix')
+    group.add_option('', '--dry-run', action='store_true', dest='dryRun', default=False,
+                      help='only print atlas layout statistics, do not write atlases')
+    group.add_option('', '--watch', action='store_true', dest='watch', default=False,
+                      help='keep running and rebuild atlases when images change, '
+                           'reloading only changed images (implies --incremental)')
+    group.add_option('', '--watch-interval', type='float', action='store', dest='watchInterval', default=0.5,
+                      help='poll interval for --watch in seconds [default %default]')
+    parser.add_option_group(group)
+
+    group = optparse.OptionGroup(parser, 'Batch options')
+    group.add_option('', '--batch', action='store', dest='batchConfig', default=None,
+                      help='build atlas groups from JSON config file, command line options are defaults for all groups')
+    group.add_option('', '--batch-subdirs', action='store_true', dest='batchSubdirs', default=False,
+                      help='build a separate atlas group from each subdirectory of directory')
+    group.add_option('', '--memory-limit', type='int', action='store', dest='memoryLimit', default=0,
+                      help='limit estimated memory of groups built at once, in megabytes (0 for no limit) [default %default]')
     parser.add_option_group(group)
     (options, args) = parser.parse_args()
     
-    if len(args) != 1:
+    if len(args) != (options.batchConfig is None and 1 or 0):
         parser.print_help()
-        print '*** Directory is required'
+        print '*** Directory is required (and cannot be used with --batch)'
         exit(1)
-    options.directory = args[0]
+    options.directory = args and args[0] or None
     
     if options.sortOn not in ('width', 'height'):
         parser.print_help()
         print '*** Sort parameter must be either width or height'
         exit(1)
     
-    if options.format not in WRITERS.keys():
+    if options.packer not in PACKERS.keys():
+        parser.print_help()
+        print '*** Invalid packer. Possible packers: %s' % ', '.join(sorted(PACKERS.keys()))
+        exit(1)
+    
+    if options.heuristic is not None and (options.packer not in MAXRECTS_PACKERS or options.heuristic not in MAXRECTS_HEURISTICS):
+        parser.print_help()
+        print '*** Heuristic must be used with %s packer. Possible heuristics: %s' % (' or '.join(MAXRECTS_PACKERS), ', '.join(MAXRECTS_HEURISTICS))
+        exit(1)
+    
+    if options.sizing is not None and (options.sizing not in ATLAS_SIZINGS or options.dontOptimize):
+        parser.print_help()
+        print '*** Shrink mode must be one of %s and cannot be used with --no-optimize' % ', '.join(ATLAS_SIZINGS)
+        exit(1)
+    
+    if options.jobs < 1:
+        parser.print_help()
+        print '*** Jobs count must be positive'
+        exit(1)
+
+    if options.writeJobs < 0:
+        parser.print_help()
+        print '*** Write jobs count must not be negative'
+        exit(1)
+    
+    if options.bandHeight < 0:
+        parser.print_help()
+        print '*** Band height must not be negative'
+        exit(1)
+
+    if options.pixelFormat not in PIXEL_FORMATS or options.textureContainer not in TEXTURE_CONTAINERS:
+        parser.print_help()
+        print '*** Pixel format must be one of %s and texture container one of %s' % \
+              (', '.join(PIXEL_FORMATS), ', '.join(TEXTURE_CONTAINERS))
+        exit(1)
+
+    textureFormat = TextureFormat(options.pixelFormat, options.dither, options.textureContainer)
+    if options.bandHeight and not textureFormat.isDefault:
+        parser.print_help()
+        print '*** Band height cannot be used with pixel format conversion or KTX textures'
+        exit(1)
+
+    try:
+        scales = options.scales is not None and parseScales(options.scales) or None
+    except Exception, e:
+        parser.print_help()
+        print '*** %s' % e
+        exit(1)
+    # Гильотинный алгоритм не всегда оставляет отступ между изображениями, а без него изображения
+    # могут пересечься в уменьшенных атласах.
+    if scales is not None and (options.bandHeight or options.packer not in MAXRECTS_PACKERS):
+        parser.print_help()
+        print '*** Scales cannot be used with --band-height and require %s packer' % ' or '.join(MAXRECTS_PACKERS)
+        exit(1)
+
+    if options.watch and (options.dryRun or options.watchInterval <= 0):
+        parser.print_help()
+        print '*** Watch mode cannot be used with --dry-run and requires positive poll interval'
+        exit(1)
+
+    batchMode = options.batchConfig is not None or options.batchSubdirs
+    if batchMode and (options.batchConfig is not None and options.batchSubdirs or options.watch or options.dryRun or \
+                      options.cache or options.profile or options.metricsJson or options.memoryLimit < 0):
+        parser.print_help()
+        print '*** Batch mode cannot be used with --watch, --dry-run, --cache, --profile and --metrics-json'
+        exit(1)
+
+    if options.format not in WRITERS.keys() and not (batchMode and options.format is None):
         print '*** Invalid output format. Possible formats: %s' % ', '.join(WRITERS.keys())
         exit(1)
+
+    # Пакетная сборка: одновременно собираются до options.jobs групп, каждая в отдельном процессе.
+    if batchMode:
+        defaults = dict((key, getattr(options, key)) for key in GROUP_OPTIONS)
+        try:
+            if options.batchConfig is not None:
+                groups = loadBatchConfig(options.batchConfig, defaults)
+            else:
+                groups = subdirectoryGroups(options.directory, defaults)
+            checkGroupOutputs(groups)
+        except Exception, e:
+            print '*** Invalid batch: %s' % e
+            exit(1)
+        if not groups:
+            print '*** No batch groups found'
+            exit(1)
+        results = runBatch(groups, options.jobs, options.memoryLimit << 20, sys.stdout)
+        printBatchSummary(results, sys.stdout)
+        exit(any(result['error'] is not None for result in results) and 1 or 0)
     
     # Поиск изображений для создания атласов.
+    log = options.verbose and sys.stdout or None
+    cache = options.cache and MetadataCache(options.cache, log) or None
+    metrics = (options.profile or options.metricsJson) and BuildMetrics() or None
+    def reportMetrics():
+        '''Вывод и запись собранных метрик сборки.'''
+        if options.profile:
+            metrics.printSummary(sys.stdout)
+        if options.metricsJson:
+            metrics.save(options.metricsJson)
     atlasManager = AtlasManager(options.directory, options.maxWidth, options.maxHeight, options.skipDimensionSum,
-                                options.alphaThreshold, options.dontOptimize, options.padding,
-                                options.verbose and sys.stdout or None)
-    for root, dirs, files in os.walk(options.directory):
-        for filename in files:
-            basename, ext = os.path.splitext(filename)
-            if ext != '.png':
-                continue
-            atlasManager.appendImage(filename, os.path.join(root, filename))
+                                options.alphaThreshold, options.dontOptimize, packingPadding(options.padding, scales or [1]),
+                                log, options.lazyLoad or options.dryRun, cache, metrics)
+    watcher = options.watch and DirectoryWatcher(options.directory, options.watchInterval) or None
+    images = watcher is not None and watcher.images or findImages(options.directory)
+    atlasManager.appendImages(images, options.jobs)
+    if cache is not None:
+        cache.save()
     
     # Генерация атласов.
     if atlasManager.count == 0:
         print '*** No images found'
         exit(1)
     
+    strategy = {'sortOn': options.sortOn, 'packer': options.packer, 'heuristic': options.heuristic}
+    if options.search:
+        strategy = atlasManager.searchPackingStrategy(options.sortOn, options.packer, options.heuristic,
+                                                      options.jobs, options.searchTime, options.allowRotation,
+                                                      scales is not None and MAXRECTS_PACKERS or None)
+
+    # Вывод статистики размещения без записи атласов.
+    if options.dryRun:
+        layouts = atlasManager.planLayout(sizing=options.sizing, allowRotation=options.allowRotation, **strategy)
+        for index, layout in enumerate(layouts):
+            print '%s%d: %s' % (options.outputName, index, layout)
+        texels = sum(layout.texels for layout in layouts)
+        print 'total: atlases %d, images %d (duplicates %d), texels %d, occupancy %.1f%%' % \
+              (len(layouts), atlasManager.count, sum(layout.duplicateCount for layout in layouts), texels,
+               100.0 * sum(layout.usedArea for layout in layouts) / texels)
+        if metrics is not None:
+            reportMetrics()
+        exit(0)
+
     if not os.path.exists(options.outputDirectory):
         os.makedirs(options.outputDirectory)
-    atlasManager.generateAtlases(os.path.join(options.outputDirectory, options.outputName), options.sortOn, options.format)
+    basePath = os.path.join(options.outputDirectory, options.outputName)
+    manifest = (options.incremental or options.watch) and BuildManifest(basePath + '.manifest', log) or None
+    def generateAtlases():
+        '''Сборка атласов с выбранной стратегией размещения.'''
+        atlasManager.generateAtlases(basePath, writer=options.format, manifest=manifest, writeJobs=options.writeJobs,
+                                     bandHeight=options.bandHeight or None, sizing=options.sizing,
+                                     allowRotation=options.allowRotation, textureFormat=textureFormat, scales=scales,
+                                     **strategy)
+    generateAtlases()
+
+    # Пересборка атласов при изменении изображений. Метаданные неизменившихся изображений
+    # и стратегия размещения сохраняются между сборками.
+    if watcher is not None:
+        print 'Watching "%s" for changes, press Ctrl+C to stop' % options.directory
+        try:
+            while True:
+                images = watcher.waitForChanges()
+                startTime = time.time()
+                try:
+                    loadedCount = atlasManager.updateImages(images, options.jobs)
+                    if cache is not None:
+                        cache.save()
+                    if atlasManager.count == 0:
+                        print '*** No images found'
+                        continue
+                    generateAtlases()
+                except Exception, e:
+                    print '*** Build failed: %s' % e
+                    continue
+                print 'Atlases rebuilt in %.2fs (images %d, reloaded %d)' % \
+                      (time.time() - startTime, atlasManager.count, loadedCount)
+        except KeyboardInterrupt:
+            pass
+    if metrics is not None:
+        reportMetrics()
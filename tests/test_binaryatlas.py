@@ -0,0 +1,99 @@
+# coding: utf-8
+'''
+Сравнение двоичного описания атласа, прочитанного BinaryAtlasReader, с описанием cocos2d для тех же изображений.
+Запуск из корня репозитория: python -m unittest discover tests
+'''
+import os
+import re
+import sys
+import glob
+import random
+import shutil
+import plistlib
+import tempfile
+import unittest
+import subprocess
+from PIL import Image
+from atlaslib.binaryatlas import BinaryAtlasReader, packBinaryAtlas, MAX_COORDINATE, MAX_NAME_LENGTH
+
+ATLASTOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'atlastool.py')
+
+def parseNumbers(text):
+    '''Числа из строки вида "{{x, y}, {ширина, высота}}".'''
+    return tuple(int(value) for value in re.findall(r'-?\d+', text))
+
+
+class BinaryAtlasTest(unittest.TestCase):
+    '''Кадры двоичного описания совпадают с кадрами описания cocos2d, собранного с теми же параметрами.'''
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        imageDirectory = os.path.join(self.__directory, 'images')
+        os.makedirs(imageDirectory)
+
+        # Изображения с прозрачными краями разной ширины, вытянутые (для поворота) и одинаковые (дубликаты).
+        rand = random.Random(1)
+        for index in xrange(80):
+            width, height = rand.randint(2, 60), rand.randint(2, 60)
+            image = Image.new('RGBA', (width + 8, height + 8))
+            left, top = rand.randint(0, 8), rand.randint(0, 8)
+            image.paste((rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255), 255),
+                        (left, top, left + width, top + height))
+            image.save(os.path.join(imageDirectory, 'sprite%02d.png' % index))
+        shutil.copy(os.path.join(imageDirectory, 'sprite00.png'), os.path.join(imageDirectory, 'copy.png'))
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def testRoundTrip(self):
+        for options in ([], ['--packer', 'maxrects', '--allow-rotation']):
+            plistDirectory = self.__build('cocos2d', options)
+            binaryDirectory = self.__build('binary', options)
+            plistFiles = sorted(glob.glob(os.path.join(plistDirectory, '*.png.plist')))
+            self.assertTrue(plistFiles)
+            self.assertEqual(len(plistFiles), len(glob.glob(os.path.join(binaryDirectory, '*.atlasbin'))))
+            for plistFile in plistFiles:
+                baseName = os.path.basename(plistFile)[:-len('.png.plist')]
+                self.__compare(plistlib.readPlist(plistFile), os.path.join(binaryDirectory, baseName + '.atlasbin'))
+
+    def testFormatLimits(self):
+        # Кадры, не помещающиеся в поля записи, вызывают исключение с именем кадра, а не struct.error.
+        geometry = (0, 0, 10, 10, 0, 0, 10, 10)
+        for name, frameGeometry, message in ((u'\u044f' * (MAX_NAME_LENGTH / 2 + 1), geometry, 'name is too long'),
+                                             (u'big', geometry[:7] + (MAX_COORDINATE + 1,), 'geometry does not fit')):
+            with self.assertRaises(Exception) as context:
+                packBinaryAtlas((128, 128), [(name,) + frameGeometry + (False,)])
+            self.assertIn(message, str(context.exception))
+            self.assertIn(name.encode('utf-8'), str(context.exception))
+        packBinaryAtlas((128, 128), [(u'a' * MAX_NAME_LENGTH,) + geometry + (False,)])
+
+    def __build(self, writer, options):
+        '''Сборка атласов изображений в заданном формате. Возвращает каталог с атласами.'''
+        outputDirectory = os.path.join(self.__directory, '%s%s' % (writer, ''.join(options)))
+        subprocess.check_call([sys.executable, ATLASTOOL, '-f', writer, '-W', '128', '-H', '128', '-o', outputDirectory] +
+                              options + [os.path.join(self.__directory, 'images')], stdout=open(os.devnull, 'w'))
+        return outputDirectory
+
+    def __compare(self, plist, binaryFile):
+        '''Сравнение кадров описания cocos2d (разобранного plist) и двоичного описания.'''
+        reader = BinaryAtlasReader(binaryFile)
+        try:
+            self.assertEqual(reader.atlasSize, parseNumbers(plist['metadata']['size']))
+            self.assertEqual(len(reader), len(plist['frames']))
+            for name, frame in plist['frames'].iteritems():
+                binaryFrame = reader.find(name)
+                self.assertTrue(binaryFrame is not None, 'Frame "%s" not found' % name)
+                self.assertEqual(binaryFrame.name, name)
+                self.assertEqual((binaryFrame.x, binaryFrame.y, binaryFrame.width, binaryFrame.height),
+                                 parseNumbers(frame['frame']))
+                self.assertEqual(binaryFrame.rotated, frame.get('rotated', False))
+                self.assertEqual((binaryFrame.sourceX, binaryFrame.sourceY, binaryFrame.width, binaryFrame.height),
+                                 parseNumbers(frame['sourceColorRect']))
+                self.assertEqual((binaryFrame.originalWidth, binaryFrame.originalHeight), parseNumbers(frame['sourceSize']))
+            self.assertEqual(sorted(frame.name for frame in reader.frames()), sorted(plist['frames'].iterkeys()))
+        finally:
+            reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# coding: utf-8
+'''
+Сравнение обрезания прозрачных краев (AtlasImageInfo) с прежним построчным сканированием альфа-канала.
+Запуск из корня репозитория: python -m unittest discover tests
+'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+from atlaslib.imageinfo import AtlasImageInfo
+
+def findBorder(data, firstRange, firstStride, secondRange, secondStride, alphaThreshold):
+    '''Сканирование изображения в заданном направлении в поисках полосы непрозрачности (прежняя реализация).'''
+    for i in firstRange:
+        for j in secondRange:
+            if data[i * firstStride + j * secondStride][3] >= alphaThreshold:
+                return i
+    return None
+
+def scannedBBox(image, alphaThreshold):
+    '''Граница непрозрачной области (minX, minY, maxX, maxY) прежним сканированием изображения в режиме RGBA.'''
+    data = image.convert('RGBA').getdata()
+    width, height = image.size
+    minX = findBorder(data, xrange(width), 1, xrange(height), width, alphaThreshold)
+
+    # Изображение полностью прозрачно.
+    if minX is None:
+        return (0, 0, 1, 1)
+    maxX = findBorder(data, xrange(width - 1, -1, -1), 1, xrange(height), width, alphaThreshold)
+    minY = findBorder(data, xrange(height), width, xrange(width), 1, alphaThreshold)
+    maxY = findBorder(data, xrange(height - 1, -1, -1), width, xrange(width), 1, alphaThreshold)
+    return (minX, minY, maxX + 1, maxY + 1)
+
+
+class TrimTest(unittest.TestCase):
+    '''Обрезание совпадает с прежним сканированием для разных режимов изображений и порогов прозрачности.'''
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def testModes(self):
+        rand = random.Random(1)
+        for index in xrange(6):
+            width, height = rand.randint(1, 14), rand.randint(1, 14)
+            alpha = Image.new('L', (width, height))
+            alpha.putdata([rand.choice((0, 0, 0, rand.randint(0, 255))) for i in xrange(width * height)])
+            color = Image.new('RGB', (width, height), (rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255)))
+            rgba = Image.merge('RGBA', color.split() + (alpha,))
+            gray = color.convert('L')
+            palette = color.convert('P')
+            palette.info['transparency'] = palette.getpixel((0, 0))
+            self.__checkImages(index, [rgba, Image.merge('LA', (gray, alpha)), color, gray, palette])
+
+    def testTransparent(self):
+        for mode, color in (('RGBA', (255, 255, 255, 0)), ('LA', (255, 0))):
+            self.__checkImages(mode, [Image.new(mode, (7, 5), color)])
+
+    def __checkImages(self, prefix, images):
+        '''Сравнение границ для всех порогов прозрачности 1..255.'''
+        for image in images:
+            path = os.path.join(self.__directory, '%s-%s.png' % (prefix, image.mode))
+            image.save(path, transparency=image.info.get('transparency'))
+            decoded = Image.open(path)
+            for alphaThreshold in xrange(1, 256):
+                imageInfo = AtlasImageInfo(os.path.basename(path), path, path, alphaThreshold, 0)
+                self.assertEqual(imageInfo.sourceRect.coordinateTuple, scannedBBox(decoded, alphaThreshold),
+                                 'Image %s, alpha threshold %d' % (path, alphaThreshold))
+
+
+if __name__ == '__main__':
+    unittest.main()